@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from eeg.sample_store import is_sample_store, iter_samples, read_header, SampleStoreWriter
+
+"""
+Band-power features
+
+Summarizes the filtered signal as the power of every channel in the classic
+EEG bands over sliding windows, so the visuals and the audio step through
+feature frames instead of raw samples. With the default 2 s window and
+0.1 s hop, one second of EEG becomes 10 frames, which the 10 fps videos
+play back in real time, whatever the sampling rate.
+
+All windows of a chunk are taken as strided views of the samples and
+transformed with one batched real FFT. The power of each band is the sum of
+the periodogram bins in its range, as one matrix product with a bin-to-band
+mask. By default the powers are relative, so the bands of a channel add up
+to 1 and the features have the same scale across visitors.
+
+The 16-column output holds the four bands of O1, then of O2, T3 and T4, so
+each radar spoke is one channel and band and each quadrant is one channel.
+The optional 4-column output holds AUDIO_BAND per channel, in the channel
+order the audio generators expect.
+
+Source: https://en.wikipedia.org/wiki/Electroencephalography
+"""
+BANDS = [
+    ('delta', 1, 4),
+    ('theta', 4, 8),
+    ('alpha', 8, 13),
+    ('beta', 13, 30),
+]
+AUDIO_BAND = 'alpha'
+SAMPLING_FREQUENCY = 250  # For CSV input, sample stores carry their own rate
+WINDOW_SECONDS = 2.0
+HOP_SECONDS = 0.1
+CHUNK_SIZE = 65536
+
+def band_matrix(window_size, sampling_frequency, bands=BANDS):
+    """(frequency bins x bands) mask of the rfft bins in every [low, high) band."""
+    frequencies = np.fft.rfftfreq(window_size, 1 / sampling_frequency)
+    return np.array([(frequencies >= low) & (frequencies < high) for name, low, high in bands], dtype=np.float64).T
+
+def band_power(block, window_size, hop, sampling_frequency, relative=True, bands=BANDS):
+    """
+    Band power of every full window of a (samples x channels) block.
+
+    Windows start every `hop` samples from the first one. Returns a
+    (windows x channels x bands) array.
+    """
+    block = np.asarray(block, dtype=np.float64)
+    if len(block) < window_size:
+        return np.empty((0, block.shape[1], len(bands)))
+
+    windows = sliding_window_view(block, window_size, axis=0)[::hop]
+    windows = windows - windows.mean(axis=-1, keepdims=True)
+    spectrum = np.fft.rfft(windows * np.hanning(window_size), axis=-1)
+    power = (spectrum.real ** 2 + spectrum.imag ** 2) @ band_matrix(window_size, sampling_frequency, bands)
+    if relative:
+        total = power.sum(axis=-1, keepdims=True)
+        power = np.divide(power, total, out=np.zeros_like(power), where=total > 0)
+    return power
+
+def feature_columns(channels, bands=BANDS):
+    return [f'{channel}_{name}' for channel in channels for name, low, high in bands]
+
+class _FeatureWriter:
+    def __init__(self, path, columns, frame_rate, filters):
+        self.path = path
+        if is_sample_store(path):
+            self.writer = SampleStoreWriter(path, columns, frame_rate, filters=filters, mode='w')
+        else:
+            self.writer = None
+            pd.DataFrame(columns=columns).to_csv(path, index=False)
+
+    def write_rows(self, rows):
+        if self.writer is not None:
+            self.writer.write_rows(rows)
+        else:
+            pd.DataFrame(rows).to_csv(self.path, mode='a', index=False, header=False)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def compute_band_power(input_file, output_file, audio_file=None, window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS,
+                       relative=True, chunk_size=CHUNK_SIZE):
+    """
+    Turn a 4-channel sample file into band-power feature frames.
+
+    Either side can be a binary sample store or a CSV file (chosen by the `.csv` extension).
+    The input is streamed in chunks, carrying the samples of unfinished windows over to the next one.
+
+    Parameters:
+        input_file (str): Filtered samples, one column per channel.
+        output_file (str): Features with one column per channel and band, see `feature_columns`.
+        audio_file (str): If given, AUDIO_BAND of every channel is written there as well.
+        window_seconds (float): Length of the analysis windows.
+        hop_seconds (float): Time between the starts of consecutive windows, the frame period.
+        relative (bool): Divide the band powers of each channel by their sum.
+        chunk_size (int): Number of samples read per chunk.
+
+    Returns the number of feature frames written.
+    """
+    print('compute_band_power start')
+
+    if is_sample_store(input_file):
+        metadata = read_header(input_file)[0]
+        channels = metadata['channels']
+        sampling_frequency = metadata['sample_rate'] or SAMPLING_FREQUENCY
+    else:
+        metadata = {}
+        channels = ['O1', 'O2', 'T3', 'T4']
+        sampling_frequency = SAMPLING_FREQUENCY
+    window_size = int(round(window_seconds * sampling_frequency))
+    hop = max(1, int(round(hop_seconds * sampling_frequency)))
+    frame_rate = sampling_frequency / hop
+    filters = dict(metadata.get('filters') or {}, window_seconds=window_seconds, hop_seconds=hop_seconds, relative=relative)
+    audio_band = [name for name, low, high in BANDS].index(AUDIO_BAND)
+
+    writer = _FeatureWriter(output_file, feature_columns(channels), frame_rate, filters)
+    audio_writer = _FeatureWriter(audio_file, list(channels), frame_rate, filters) if audio_file else None
+    frames = 0
+    pending = np.empty((0, len(channels)))
+    try:
+        for chunk in iter_samples(input_file, chunk_size, header=None):
+            if chunk.shape[1] != len(channels):
+                raise ValueError(f"Input data must have exactly {len(channels)} columns.")
+            pending = np.concatenate([pending, chunk])
+            power = band_power(pending, window_size, hop, sampling_frequency, relative)
+            if len(power):
+                writer.write_rows(power.reshape(len(power), -1))
+                if audio_writer is not None:
+                    audio_writer.write_rows(power[:, :, audio_band])
+                frames += len(power)
+                pending = pending[len(power) * hop:]
+    finally:
+        writer.close()
+        if audio_writer is not None:
+            audio_writer.close()
+
+    print(f"... {frames} frames of {window_seconds} s every {hop_seconds} s ({frame_rate:.1f} frames/s) saved to {output_file}")
+    print('compute_band_power end')
+    return frames
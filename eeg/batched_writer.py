@@ -0,0 +1,131 @@
+import csv
+import numpy as np
+import queue
+import threading
+import time
+
+"""
+Batched background writer
+
+The neurosdk callback thread must never block on disk I/O. Rows are handed
+over through a bounded buffer to a single background thread which owns one
+long-lived sink and flushes when either `flush_rows` rows are pending
+or `flush_interval` seconds have passed since the last flush.
+
+Producers hand over single rows or whole (rows x channels) blocks; the buffer
+holds one entry per call. A sink is any object with `write_rows(rows)`,
+`flush()` and `close()`, where `rows` is a 2-D array.
+"""
+BUFFER_SIZE = 10000
+FLUSH_ROWS = 250
+FLUSH_INTERVAL = 0.5
+
+_CLOSE = object()
+
+class CsvSink:
+    def __init__(self, output_file, mode='a'):
+        self.output_file = output_file
+        self._file = open(output_file, mode=mode, newline='')
+        self._writer = csv.writer(self._file)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows.tolist())
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class BatchedWriter:
+    def __init__(self, sink, buffer_size=BUFFER_SIZE, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.sink = sink
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flush_count = 0
+        self.flush_latency_total = 0.0
+        self.flush_latency_max = 0.0
+        self.high_water_mark = 0
+
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._thread = threading.Thread(target=self._run, name='batched-writer', daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    def write_row(self, row):
+        self.write_block([row])
+
+    def write_block(self, block):
+        """Queue a block of rows without blocking. The block is dropped and counted if the buffer is full or the writer closed."""
+        if self._closed:
+            # The background thread has stopped, nothing queued now would reach the sink
+            self.rows_dropped += len(block)
+            return
+        try:
+            self._buffer.put_nowait(block)
+        except queue.Full:
+            self.rows_dropped += len(block)
+            return
+        pending = self._buffer.qsize()
+        if pending > self.high_water_mark:
+            self.high_water_mark = pending
+
+    def close(self):
+        """Flush everything still buffered, close the sink and stop the thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer.put(_CLOSE)
+        self._thread.join()
+        self.sink.close()
+
+    def stats(self):
+        return {
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'flush_count': self.flush_count,
+            'flush_latency_avg': self.flush_latency_total / self.flush_count if self.flush_count else 0.0,
+            'flush_latency_max': self.flush_latency_max,
+            'buffer_high_water_mark': self.high_water_mark,
+        }
+
+    def _flush(self, pending):
+        if not pending:
+            return
+        start = time.perf_counter()
+        rows = np.concatenate([np.asarray(block).reshape(len(block), -1) for block in pending])
+        self.sink.write_rows(rows)
+        self.sink.flush()
+        latency = time.perf_counter() - start
+
+        self.rows_written += len(rows)
+        self.flush_count += 1
+        self.flush_latency_total += latency
+        self.flush_latency_max = max(self.flush_latency_max, latency)
+        pending.clear()
+
+    def _run(self):
+        pending = []
+        pending_rows = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                block = self._buffer.get(timeout=timeout)
+            except queue.Empty:
+                block = None
+
+            if block is _CLOSE:
+                self._flush(pending)
+                return
+            if block is not None and len(block):
+                pending.append(block)
+                pending_rows += len(block)
+
+            if pending_rows >= self.flush_rows or time.monotonic() >= deadline:
+                self._flush(pending)
+                pending_rows = 0
+                deadline = time.monotonic() + self.flush_interval
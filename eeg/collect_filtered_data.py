@@ -1,11 +1,15 @@
-import csv
 import concurrent.futures
+import numpy as np
+import os
 import pandas as pd
-import queue
-from filters_lib import filters_sdk, filter_types
+import threading
+import time
+from eeg.batched_writer import BatchedWriter
+from eeg.iir_filter import design_filter, MultichannelFilter
+from eeg.ring_buffer import RingBuffer
+from eeg.sample_store import create_sink
 from neurosdk.scanner import Scanner
 from neurosdk.cmn_types import *
-from time import sleep
 
 """
 Filter setup
@@ -15,91 +19,250 @@ Luxembourg's power grit has a frequency of 50Hz so we exclude it here.
 High and low pass based on Brainbit's recommendations. 
 A heealthy human eeg frequency range is 1 - 30-70Hz.
 
+Each packet block is filtered for all four channels at once by a cascade of
+second-order sections, with separate filter state per channel.
+
 Source: https://sdk.brainbit.com/device-recommendation/
 Source: https://en.wikipedia.org/wiki/Electroencephalography
 """
-FILTER_LIST = filters_sdk.FilterList()
 SAMPLING_FREQUENCY = 250
 EXCLUDE_FREQUENCY = 50 
 HIGH_PASS_FREQUENCY = 1
 LOW_PASS_FREQUENCY = 30
+FILTER_SETTINGS = {
+    'band_stop': EXCLUDE_FREQUENCY,
+    'high_pass': HIGH_PASS_FREQUENCY,
+    'low_pass': LOW_PASS_FREQUENCY,
+}
+CHANNELS = ['O1', 'O2', 'T3', 'T4']
+
+"""
+Acquisition completes on events, not fixed sleeps: scanning stops
+SCAN_SETTLE seconds after the first sensor is found, so sensors switched on
+together are picked up as well, or as soon as `sensor_count` sensors are
+found if a count is given, and recording stops once TARGET_SAMPLES filtered
+samples are captured from every sensor. The timeouts only bound the wait if
+that never happens. Scanning for the whole SCAN_TIMEOUT is opt-in with
+`sensor_count=ALL_SENSORS`.
+
+Every sensor found gets its own SensorSession with its own filter state,
+output files and a ring buffer holding its last BUFFER_SECONDS of filtered
+samples for live consumers. All sensors are connected in parallel and
+stream at the same time, each from its own neurosdk callback thread.
+"""
+SCAN_TIMEOUT = 5
+SCAN_SETTLE = 0.5
+ALL_SENSORS = 'all'
+TARGET_SAMPLES = 5 * SAMPLING_FREQUENCY
+SIGNAL_TIMEOUT = 10
+BUFFER_SECONDS = 60
+
+OUTPUT_FILE = 'data/data_filtered.bin'
+RAW_OUTPUT_FILE = 'data/data_raw.bin'
 
-DATA_QUEUE = queue.Queue()
-OUTPUT_FILE = 'data/data_filtered.csv'
-    
-def sensor_found(scanner, sensors):
-    for index in range(len(sensors)):
-        print('... sensor found: %s' % sensors[index])
- 
 def on_sensor_state_changed(sensor, state):
     print('... sensor {0} is {1}'.format(sensor.name, state))
  
 def on_battery_changed(sensor, battery):
-    print('... battery: {0}'.format(battery))
- 
-def save_filtered_data_to_csv(filtered_O1, filtered_O2, filtered_T3, filtered_T4):
-    with open(OUTPUT_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([filtered_O1, filtered_O2, filtered_T3, filtered_T4])
-  
-def on_signal_received(sensor, data):
-    for packet in data:
-        DATA_QUEUE.put(packet)
-        filtered_O1 = FILTER_LIST.filter(packet.O1)
-        filtered_O2 = FILTER_LIST.filter(packet.O2)
-        filtered_T3 = FILTER_LIST.filter(packet.T3)
-        filtered_T4 = FILTER_LIST.filter(packet.T4)
-        save_filtered_data_to_csv(filtered_O1, filtered_O2, filtered_T3, filtered_T4)
-
-def collect_filtered_data():
-    f1 = filters_sdk.Filter()
-    f1.init_by_param(filter_types.FilterParam(filter_types.FilterType.ft_band_stop, SAMPLING_FREQUENCY, EXCLUDE_FREQUENCY))
-    
-    f2 = filters_sdk.Filter()
-    f2.init_by_param(filter_types.FilterParam(filter_types.FilterType.ft_lp, SAMPLING_FREQUENCY, LOW_PASS_FREQUENCY))
-    
-    f3 = filters_sdk.Filter()
-    f3.init_by_param(filter_types.FilterParam(filter_types.FilterType.ft_hp, SAMPLING_FREQUENCY, HIGH_PASS_FREQUENCY))
-    
-    FILTER_LIST.add_filter(f1)
-    FILTER_LIST.add_filter(f2)
-    FILTER_LIST.add_filter(f3)
-    
+    print('... {0} battery: {1}'.format(sensor.name, battery))
+
+def print_writer_stats(label, writer):
+    stats = writer.stats()
+    print('... {0} rows written: {1}, dropped: {2}'.format(label, stats['rows_written'], stats['rows_dropped']))
+    print('... {0} flush latency avg: {1:.2f} ms, max: {2:.2f} ms'.format(label, stats['flush_latency_avg'] * 1000, stats['flush_latency_max'] * 1000))
+    print('... {0} buffer high-water mark: {1}'.format(label, stats['buffer_high_water_mark']))
+
+def packets_to_block(data):
+    return np.array([(packet.O1, packet.O2, packet.T3, packet.T4) for packet in data], dtype=np.float64)
+
+def sensor_output_file(path, index):
+    """Output file of the `index`-th sensor: `path` itself for the first one, `<name>_<index + 1><ext>` for the others."""
+    if path is None or index == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}_{index + 1}{ext}'
+
+class SensorSession:
+    """Connection, filter state and writers of one sensor, fed by that sensor's signal callback."""
+    def __init__(self, info, sos, output_file, raw_output_file=None, target_samples=TARGET_SAMPLES):
+        self.info = info
+        self.sos = sos
+        self.output_file = output_file
+        self.raw_output_file = raw_output_file
+        self.target_samples = target_samples
+
+        self.sensor = None
+        self.filter = None
+        self.writer = None
+        self.raw_writer = None
+        self.buffer = RingBuffer(BUFFER_SECONDS * SAMPLING_FREQUENCY, len(CHANNELS))
+        self.samples_captured = 0
+        self.complete = threading.Event()
+
+        self.connect_time = 0.0
+        self.signal_start = None
+        self.signal_time = 0.0
+
+    @property
+    def name(self):
+        return str(self.info)
+
+    def connect(self, scanner):
+        start = time.perf_counter()
+        self.sensor = scanner.create_sensor(self.info)
+        self.connect_time = time.perf_counter() - start
+        print("... {0} connected in {1:.2f} s".format(self.name, self.connect_time))
+
+        self.sensor.sensorStateChanged = on_sensor_state_changed
+        self.sensor.batteryChanged = on_battery_changed
+        return self
+
+    def start(self):
+        """Start the signal. Returns False if the sensor doesn't support it."""
+        if not self.sensor.is_supported_feature(SensorFeature.Signal):
+            print("... {0} has no signal, skipped".format(self.name))
+            return False
+
+        self.filter = MultichannelFilter(self.sos, len(CHANNELS))
+        self.writer = BatchedWriter(create_sink(self.output_file, CHANNELS, SAMPLING_FREQUENCY, filters=FILTER_SETTINGS))
+        if self.raw_output_file:
+            self.raw_writer = BatchedWriter(create_sink(self.raw_output_file, CHANNELS, SAMPLING_FREQUENCY))
+        self.samples_captured = 0
+        self.complete.clear()
+        self.signal_start = time.perf_counter()
+        self.sensor.signalDataReceived = self.on_signal_received
+        self.sensor.exec_command(SensorCommand.StartSignal)
+        print("... {0} start signal until {1} samples are captured into {2}".format(self.name, self.target_samples, self.output_file))
+        return True
+
+    def on_signal_received(self, sensor, data):
+        # close() may run on another thread meanwhile, so this callback works on the objects it started with
+        signal_filter, writer, raw_writer = self.filter, self.writer, self.raw_writer
+        if signal_filter is not None and writer is not None and len(data):
+            block = packets_to_block(data)
+            if raw_writer is not None:
+                raw_writer.write_block(block)
+            filtered = signal_filter.process(block)
+            writer.write_block(filtered)
+            self.buffer.write(filtered)
+            self.samples_captured += len(block)
+            self.signal_time = time.perf_counter() - self.signal_start
+            if self.samples_captured >= self.target_samples:
+                self.complete.set()
+
+    def stop(self):
+        if self.signal_start is not None:
+            self.sensor.exec_command(SensorCommand.StopSignal)
+            print("... {0} stop signal".format(self.name))
+
+    def close(self):
+        """Flush the writers and disconnect, safe to call more than once."""
+        # Packets still arriving after StopSignal are ignored rather than written to closed writers
+        self.filter = None
+        if self.sensor is not None:
+            self.sensor.signalDataReceived = None
+        for label, writer in (('filtered', self.writer), ('raw', self.raw_writer)):
+            if writer is not None:
+                writer.close()
+                print_writer_stats('{0} {1}'.format(self.name, label), writer)
+        self.writer = self.raw_writer = None
+
+        if self.sensor is not None:
+            self.sensor.disconnect()
+            print("... disconnect from {0}".format(self.name))
+            self.sensor = None
+
+    def throughput(self):
+        return self.samples_captured / self.signal_time if self.signal_time else 0.0
+
+    def print_stats(self):
+        print('... {0}: connected in {1:.2f} s, {2} samples in {3:.2f} s ({4:.0f} samples/s)'.format(
+            self.name, self.connect_time, self.samples_captured, self.signal_time, self.throughput()))
+        stats = self.buffer.stats()
+        print('... {0} ring buffer: {1} samples, {2} dropped, {3} overwritten'.format(
+            self.name, stats['samples_written'], stats['samples_dropped'], stats['samples_overwritten']))
+
+def scan_sensors(scanner, sensor_count=None, timeout=SCAN_TIMEOUT, settle=SCAN_SETTLE):
+    """
+    Scan until `sensor_count` sensors are found, or `settle` seconds after the first one if no count
+    is given, and return their infos. ALL_SENSORS scans for the whole `timeout`, which otherwise only
+    bounds the wait.
+    """
+    found = threading.Event()
+    target = 1 if sensor_count is None else sensor_count
+
+    def sensor_found(scanner, sensors):
+        for index in range(len(sensors)):
+            print('... sensor found: %s' % sensors[index])
+        if target != ALL_SENSORS and len(sensors) >= target:
+            found.set()
+
+    deadline = time.perf_counter() + timeout
+    scanner.sensorsChanged = sensor_found
+    scanner.start()
+    print("... searching for {0} sensor(s) for up to {1} sec".format(sensor_count or 'any', timeout))
+    if found.wait(timeout) and sensor_count is None:
+        # Further sensors switched on at the same time are usually reported right after the first
+        time.sleep(max(0.0, min(settle, deadline - time.perf_counter())))
+    scanner.stop()
+    return list(scanner.sensors())
+
+def collect_filtered_data(output_file=OUTPUT_FILE, raw_output_file=None, scanner=None, target_samples=TARGET_SAMPLES, sensor_count=None, on_start=None):
+    '''
+    Record `target_samples` filtered EEG samples from every BrainBit found, all at the same time.
+
+    The first sensor records into `output_file`, every further one into a file of its own next
+    to it, see sensor_output_file. Scanning ends SCAN_SETTLE seconds after the first sensor is
+    found, or as soon as `sensor_count` were found if given; ALL_SENSORS uses every sensor found
+    within SCAN_TIMEOUT.
+
+    If `raw_output_file` is given, the unfiltered packets are recorded there as well so the
+    session can be re-filtered offline or replayed with eeg.replay_sensor.ReplayScanner,
+    which can also be passed in as `scanner` instead of scanning for real devices.
+
+    `on_start` is called with every SensorSession once its signal has started, so live
+    consumers can follow the session's ring buffer while it is being recorded.
+
+    Returns the number of filtered samples captured from all sensors once every writer has been flushed.
+    '''
+    sos = design_filter(SAMPLING_FREQUENCY, EXCLUDE_FREQUENCY, HIGH_PASS_FREQUENCY, LOW_PASS_FREQUENCY)
+    sessions = []
+    connected = []
+
     try:
         print('collect_filtered_data start')
-        scanner = Scanner([SensorFamily.LEBrainBit, SensorFamily.LEBrainBitBlack])
-        scanner.sensorsChanged = sensor_found
-        scanner.start()
-        print("... starting search for 5 sec")
-        sleep(5)
-        scanner.stop()
-    
-        sensorsInfo = scanner.sensors()
-        for i in range(len(sensorsInfo)):
-            current_sensor_info = sensorsInfo[i]
-
-            def device_connection(sensor_info):
-                return scanner.create_sensor(sensor_info)
-            
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(device_connection, current_sensor_info)
-                sensor = future.result()
-                print("... device connected")
-
-            sensor.sensorStateChanged = on_sensor_state_changed
-            sensor.batteryChanged = on_battery_changed
-
-            if sensor.is_supported_feature(SensorFeature.Signal):
-                sensor.signalDataReceived = on_signal_received
-                sensor.exec_command(SensorCommand.StartSignal)
-                print("... start signal for 5 seconds")
-                sleep(5)
-                sensor.exec_command(SensorCommand.StopSignal)
-                print("... stop signal")
-
-            sensor.disconnect()
-            print("... disconnect from sensor")
-            del sensor
+        if scanner is None:
+            scanner = Scanner([SensorFamily.LEBrainBit, SensorFamily.LEBrainBitBlack])
+        sensorsInfo = scan_sensors(scanner, sensor_count)
+        sessions = [
+            SensorSession(info, sos, sensor_output_file(output_file, i), sensor_output_file(raw_output_file, i), target_samples)
+            for i, info in enumerate(sensorsInfo)
+        ]
+
+        # Bluetooth connections take seconds each, so all sensors connect at the same time
+        start = time.perf_counter()
+        if sessions:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+                futures = {executor.submit(session.connect, scanner): session for session in sessions}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        connected.append(future.result())
+                    except Exception as err:
+                        print("... {0} failed to connect: {1}".format(futures[future].name, err))
+        print("... {0} of {1} device(s) connected in {2:.2f} s".format(len(connected), len(sessions), time.perf_counter() - start))
+
+        recording = [session for session in connected if session.start()]
+        if on_start:
+            for session in recording:
+                on_start(session)
+        deadline = time.perf_counter() + SIGNAL_TIMEOUT
+        for session in recording:
+            if not session.complete.wait(max(0.0, deadline - time.perf_counter())):
+                print("... {0} signal timed out after {1} sec".format(session.name, SIGNAL_TIMEOUT))
+        for session in recording:
+            session.stop()
+        for session in connected:
+            session.close()
 
         del scanner
         print('... remove scanner')
@@ -107,3 +270,27 @@ def collect_filtered_data():
 
     except Exception as err:
         print(err)
+
+    finally:
+        for session in connected:
+            session.close()
+
+    for session in connected:
+        session.print_stats()
+    total_samples = sum(session.samples_captured for session in connected)
+    signal_time = max((session.signal_time for session in connected), default=0.0)
+    if signal_time:
+        print('... {0} samples from {1} device(s) ({2:.0f} samples/s in total)'.format(total_samples, len(connected), total_samples / signal_time))
+    return total_samples
+
+def start_collection(output_file=OUTPUT_FILE, raw_output_file=None, scanner=None, target_samples=TARGET_SAMPLES, sensor_count=None, on_start=None):
+    '''
+    Run collect_filtered_data in the background.
+
+    The returned future resolves to the number of samples captured once the data is on disk,
+    so the next stage can await it instead of sleeping.
+    '''
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(collect_filtered_data, output_file, raw_output_file, scanner, target_samples, sensor_count, on_start)
+    executor.shutdown(wait=False)
+    return future
@@ -0,0 +1,183 @@
+import numpy as np
+from eeg.sample_store import iter_samples, read_header, SampleStoreWriter
+
+"""
+Multichannel IIR filter engine
+
+Filters are cascades of second-order sections (biquads) in the same
+[b0, b1, b2, 1, a1, a2] row layout scipy uses, designed with the bilinear
+transform formulas from the Audio EQ Cookbook (Robert Bristow-Johnson).
+A Butterworth high or low pass of even order is a cascade of order / 2
+biquads with the Butterworth pole quality factors.
+
+`MultichannelFilter` runs whole (samples x channels) blocks through the
+cascade in transposed direct form II. Every channel keeps its own delay
+line, so the channels' histories never mix.
+
+Rather than stepping through the samples in Python, the cascade is written
+as one state-space system (the sections' delay elements stacked into a
+single state vector) and the recursion is unrolled over blocks of
+BLOCK_LENGTH samples: a block's output is its input times the lower
+triangular impulse-response matrix plus the response to the state it starts
+in, and its end state follows from the start state and the input the same
+way. All blocks of a chunk are multiplied at once, only the small state
+update is carried from block to block.
+
+Source: https://www.w3.org/TR/audio-eq-cookbook/
+"""
+BUTTERWORTH_ORDER = 4
+BAND_STOP_WIDTH = 4
+CHUNK_SIZE = 65536
+BLOCK_LENGTH = 64
+
+def _biquad(b, a):
+    b = np.asarray(b, dtype=np.float64) / a[0]
+    a = np.asarray(a, dtype=np.float64) / a[0]
+    return np.concatenate([b, a])
+
+def notch_sos(frequency, sampling_frequency, width=BAND_STOP_WIDTH):
+    """Band-stop biquad centred on `frequency` with a -3 dB bandwidth of `width` Hz."""
+    w0 = 2 * np.pi * frequency / sampling_frequency
+    alpha = np.sin(w0) / (2 * (frequency / width))
+    cos_w0 = np.cos(w0)
+    return np.array([_biquad([1, -2 * cos_w0, 1], [1 + alpha, -2 * cos_w0, 1 - alpha])])
+
+def butterworth_sos(kind, cutoff, sampling_frequency, order=BUTTERWORTH_ORDER):
+    """Butterworth 'lowpass' or 'highpass' filter of even `order` as order / 2 biquads."""
+    if order % 2:
+        raise ValueError("Butterworth order must be even.")
+    if kind not in ('lowpass', 'highpass'):
+        raise ValueError(f"Unknown filter kind: {kind}")
+
+    w0 = 2 * np.pi * cutoff / sampling_frequency
+    cos_w0 = np.cos(w0)
+    sections = []
+    for k in range(1, order // 2 + 1):
+        q = 1 / (2 * np.cos((2 * k - 1) * np.pi / (2 * order)))
+        alpha = np.sin(w0) / (2 * q)
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        if kind == 'lowpass':
+            b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+        else:
+            b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+        sections.append(_biquad(b, a))
+    return np.array(sections)
+
+def design_filter(sampling_frequency, band_stop, high_pass, low_pass, order=BUTTERWORTH_ORDER):
+    """Cascade of the mains band-stop and the high_pass-low_pass band-pass as second-order sections."""
+    return np.concatenate([
+        notch_sos(band_stop, sampling_frequency),
+        butterworth_sos('highpass', high_pass, sampling_frequency, order),
+        butterworth_sos('lowpass', low_pass, sampling_frequency, order),
+    ])
+
+def state_space(sos):
+    """
+    (A, B, C, D) of a cascade of transposed direct form II biquads.
+
+    The state holds the two delay elements of every section in order, and each section's
+    input is the previous section's output.
+    """
+    order = 2 * len(sos)
+    A = np.zeros((order, order))
+    B = np.zeros(order)
+    C = np.zeros(order)
+    D = 1.0
+    for section, (b0, b1, b2, _, a1, a2) in enumerate(sos):
+        i = 2 * section
+        # The section's input is C x + D u of the cascade so far
+        A[i:i + 2, :i] = np.outer([b1 - a1 * b0, b2 - a2 * b0], C[:i])
+        A[i:i + 2, i:i + 2] = [[-a1, 1], [-a2, 0]]
+        B[i:i + 2] = np.array([b1 - a1 * b0, b2 - a2 * b0]) * D
+        C[:i] *= b0
+        C[i] = 1
+        D *= b0
+    return A, B, C, D
+
+class MultichannelFilter:
+    def __init__(self, sos, channels, block_length=BLOCK_LENGTH):
+        self.sos = np.asarray(sos, dtype=np.float64)
+        self.channels = channels
+        self.block_length = block_length
+        self.system = state_space(self.sos)
+        self._blocks = {}
+        self.reset()
+
+    def reset(self):
+        # Two delay elements per section and channel
+        self.state = np.zeros((len(self.sos), 2, self.channels))
+
+    def _block_matrices(self, length):
+        """Impulse-response, initial-state response, input-to-end-state and state transition matrices of `length` samples."""
+        if length not in self._blocks:
+            A, B, C, D = self.system
+            powers = [np.eye(len(A))]
+            for _ in range(length):
+                powers.append(A @ powers[-1])
+            impulse = np.concatenate([[D], [C @ powers[k] @ B for k in range(length - 1)]])
+            rows = np.arange(length)
+            lags = rows[:, None] - rows[None, :]
+            response = np.where(lags >= 0, impulse[np.maximum(lags, 0)], 0.0)
+            observe = np.array([C @ powers[k] for k in range(length)])
+            control = np.column_stack([powers[length - 1 - k] @ B for k in range(length)])
+            self._blocks[length] = (response, observe, control, powers[length])
+        return self._blocks[length]
+
+    def _process_blocks(self, x, state):
+        # x: (blocks x length x channels), state: (order x channels) at the start of the first block
+        response, observe, control, transition = self._block_matrices(x.shape[1])
+        forced = control @ x
+        starts = np.empty((len(x),) + state.shape)
+        for j in range(len(x)):
+            starts[j] = state
+            state = transition @ state + forced[j]
+        return response @ x + observe @ starts, state
+
+    def process(self, block):
+        """Filter a (samples x channels) block, carrying the per-channel state over to the next call."""
+        block = np.array(block, dtype=np.float64, ndmin=2)
+        if block.shape[1] != self.channels:
+            raise ValueError(f"Expected {self.channels} channels, got {block.shape[1]}.")
+
+        samples = len(block)
+        length = self.block_length
+        whole = samples - samples % length
+        state = self.state.reshape(-1, self.channels)
+        output = np.empty_like(block)
+        if whole:
+            y, state = self._process_blocks(block[:whole].reshape(-1, length, self.channels), state)
+            output[:whole] = y.reshape(whole, self.channels)
+        if whole < samples:
+            y, state = self._process_blocks(block[None, whole:], state)
+            output[whole:] = y[0]
+        self.state = state.reshape(len(self.sos), 2, self.channels)
+        return output
+
+def filter_recording(input_file, output_file, sampling_frequency=None, band_stop=50, high_pass=1, low_pass=30, chunk_size=CHUNK_SIZE):
+    """
+    Re-filter a raw recording offline in one streaming pass.
+
+    Parameters:
+        input_file (str): Sample store holding the unfiltered recording.
+        output_file (str): Sample store to write the filtered samples to.
+        sampling_frequency (int): Overrides the sample rate stored in the input header.
+        band_stop, high_pass, low_pass (float): Cutoff frequencies in Hz.
+        chunk_size (int): Number of samples filtered per chunk.
+    """
+    print('filter_recording start')
+
+    metadata, _ = read_header(input_file)
+    sampling_frequency = sampling_frequency or metadata['sample_rate']
+    channels = metadata['channels']
+    settings = {'band_stop': band_stop, 'high_pass': high_pass, 'low_pass': low_pass}
+
+    engine = MultichannelFilter(design_filter(sampling_frequency, **settings), len(channels))
+    writer = SampleStoreWriter(output_file, channels, sampling_frequency, filters=settings, mode='w')
+    try:
+        for chunk in iter_samples(input_file, chunk_size):
+            writer.write_rows(engine.process(chunk))
+    finally:
+        writer.close()
+
+    print(f"... filtered recording saved to {output_file}")
+    print('filter_recording end')
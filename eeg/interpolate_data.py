@@ -1,36 +1,65 @@
 import pandas as pd
 import numpy as np
+from eeg.sample_store import is_sample_store, iter_samples, read_header, SampleStoreWriter
+
+INPUT_COLUMNS = 4
+OUTPUT_COLUMNS = 16
+CHUNK_SIZE = 65536
+
+def interpolation_weights(input_columns=INPUT_COLUMNS, output_columns=OUTPUT_COLUMNS):
+    """
+    Build the (input_columns x output_columns) matrix of the linear interpolation.
+
+    Column k holds the weights `np.interp` would give the input columns for output position k,
+    so interpolating a block of rows is a single `rows @ weights` product.
+    """
+    positions = np.linspace(0, input_columns - 1, output_columns)
+    return np.array([np.interp(positions, np.arange(input_columns), unit) for unit in np.eye(input_columns)])
+
+WEIGHTS = interpolation_weights()
+
+def interpolate_block(block):
+    """Interpolate a (rows x 4) block to (rows x 16)."""
+    return np.asarray(block, dtype=np.float64) @ WEIGHTS
  
-def interpolate_to_16_columns(input_file, output_file):
+def interpolate_to_16_columns(input_file, output_file, chunk_size=CHUNK_SIZE):
     """
-    Transform a 4-column CSV file into a 16-column CSV file by interpolating values.
+    Transform a 4-column sample file into a 16-column sample file by interpolating values.
+
+    Either side can be a binary sample store or a CSV file (chosen by the `.csv` extension).
+    The input is streamed in chunks of `chunk_size` rows, so recordings don't have to fit in memory.
  
     Parameters:
-        input_file (str): Path to the input CSV file with 4 columns.
-        output_file (str): Path to save the transformed CSV file with 16 columns.
+        input_file (str): Path to the input sample store or CSV file with 4 columns.
+        output_file (str): Path to save the transformed samples with 16 columns.
+        chunk_size (int): Number of rows interpolated per chunk.
     """
     print('interpolate_data start')
 
-    # Read the 4-column data
-    data = pd.read_csv(input_file, header=None)
- 
-    # Ensure the data has exactly 4 columns
-    if data.shape[1] != 4:
-        raise ValueError("Input data must have exactly 4 columns.")
- 
-    # Create an empty list to store the expanded rows
-    expanded_data = []
- 
-    # Interpolate each row to generate 16 columns
-    for row in data.to_numpy():
-        expanded_row = np.interp(np.linspace(0, 3, 16), np.arange(4), row)
-        expanded_data.append(expanded_row)
- 
-    # Convert the expanded data back to a DataFrame
-    expanded_df = pd.DataFrame(expanded_data, columns=[f'Col{i}' for i in range(16)])
- 
-    # Save the transformed data to the output file
-    expanded_df.to_csv(output_file, index=False)
+    columns = [f'Col{i}' for i in range(OUTPUT_COLUMNS)]
+
+    if is_sample_store(output_file):
+        metadata = read_header(input_file)[0] if is_sample_store(input_file) else {}
+        writer = SampleStoreWriter(output_file, columns, metadata.get('sample_rate'), filters=metadata.get('filters'), mode='w')
+    else:
+        writer = None
+        pd.DataFrame(columns=columns).to_csv(output_file, index=False)
+
+    try:
+        for chunk in iter_samples(input_file, chunk_size, header=None):
+            # Ensure the data has exactly 4 columns
+            if chunk.shape[1] != INPUT_COLUMNS:
+                raise ValueError("Input data must have exactly 4 columns.")
+
+            expanded = interpolate_block(chunk)
+
+            if writer is not None:
+                writer.write_rows(expanded)
+            else:
+                pd.DataFrame(expanded).to_csv(output_file, mode='a', index=False, header=False)
+    finally:
+        if writer is not None:
+            writer.close()
+
     print(f"... data successfully transformed and saved to {output_file}")
     print('interpolate_data end')
-
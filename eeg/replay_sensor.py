@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import namedtuple
+from eeg.sample_store import open_samples, read_header
+from neurosdk.cmn_types import SensorCommand, SensorFeature, SensorState
+
+"""
+Replay sensor
+
+Stand-in for the parts of the neurosdk Scanner and BrainBit sensor that
+collect_filtered_data uses. It plays back a raw recording made with
+`collect_filtered_data(raw_output_file=...)`, so acquisition, filtering and
+artifact generation can be exercised without Bluetooth or a headset.
+
+speed=1 replays in real time, speed=N replays N times faster and
+speed=None emits packets as fast as the callback consumes them.
+"""
+PACKETS_PER_CALLBACK = 10
+
+ReplayPacket = namedtuple('ReplayPacket', ['PackNum', 'Marker', 'O1', 'O2', 'T3', 'T4'])
+
+class ReplaySensorInfo:
+    def __init__(self, name, address):
+        self.Name = name
+        self.Address = address
+
+    def __str__(self):
+        return f'{self.Name} ({self.Address})'
+
+class ReplaySensor:
+    def __init__(self, info, recording, speed=1.0, packets_per_callback=PACKETS_PER_CALLBACK):
+        self.name = info.Name
+        self.address = info.Address
+        self.recording = recording
+        self.speed = speed
+        self.packets_per_callback = packets_per_callback
+        self.sampling_frequency = read_header(recording)[0]['sample_rate']
+
+        self.sensorStateChanged = None
+        self.batteryChanged = None
+        self.signalDataReceived = None
+
+        self.samples_emitted = 0
+        self.elapsed = 0.0
+        self.finished = threading.Event()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_supported_feature(self, feature):
+        return feature == SensorFeature.Signal
+
+    def exec_command(self, command):
+        if command == SensorCommand.StartSignal:
+            self._stop.clear()
+            self.finished.clear()
+            self._thread = threading.Thread(target=self._emit, name='replay-sensor', daemon=True)
+            self._thread.start()
+        elif command == SensorCommand.StopSignal:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+
+    def disconnect(self):
+        self.exec_command(SensorCommand.StopSignal)
+        if self.sensorStateChanged:
+            self.sensorStateChanged(self, SensorState.StateOutOfRange)
+
+    def throughput(self):
+        return self.samples_emitted / self.elapsed if self.elapsed else 0.0
+
+    def _emit(self):
+        data = open_samples(self.recording)
+        start = time.perf_counter()
+        for offset in range(0, len(data), self.packets_per_callback):
+            if self._stop.is_set():
+                break
+
+            if self.speed:
+                due = start + offset / (self.sampling_frequency * self.speed)
+                delay = due - time.perf_counter()
+                if delay > 0 and self._stop.wait(delay):
+                    break
+
+            rows = data[offset:offset + self.packets_per_callback].tolist()
+            packets = [ReplayPacket(offset + i, 0, *row) for i, row in enumerate(rows)]
+            if self.signalDataReceived:
+                self.signalDataReceived(self, packets)
+            self.samples_emitted += len(packets)
+            self.elapsed = time.perf_counter() - start
+
+        self.finished.set()
+
+class ReplayScanner:
+    def __init__(self, recording, speed=1.0, packets_per_callback=PACKETS_PER_CALLBACK):
+        """`recording` is one raw recording or a list of them, each played back by a sensor of its own."""
+        self.recordings = [recording] if isinstance(recording, str) else list(recording)
+        self.speed = speed
+        self.packets_per_callback = packets_per_callback
+        self.sensorsChanged = None
+        self.created_sensors = []
+        self._sensors = [ReplaySensorInfo(f'Replay {i + 1}', path) for i, path in enumerate(self.recordings)]
+
+    def start(self):
+        if self.sensorsChanged:
+            self.sensorsChanged(self, self._sensors)
+
+    def stop(self):
+        pass
+
+    def sensors(self):
+        return list(self._sensors)
+
+    def create_sensor(self, info):
+        sensor = ReplaySensor(info, info.Address, speed=self.speed, packets_per_callback=self.packets_per_callback)
+        self.created_sensors.append(sensor)
+        return sensor
+
+def benchmark_replay(recording, output_file='data/replay_filtered.bin', speed=None, packets_per_callback=PACKETS_PER_CALLBACK):
+    """Run collect_filtered_data over replayed recordings, one sensor each, and report the sample throughput."""
+    from eeg.collect_filtered_data import collect_filtered_data
+
+    print('benchmark_replay start')
+    scanner = ReplayScanner(recording, speed=speed, packets_per_callback=packets_per_callback)
+    start = time.perf_counter()
+    collect_filtered_data(output_file, scanner=scanner, target_samples=min(len(open_samples(path)) for path in scanner.recordings),
+                          sensor_count=len(scanner.recordings))
+    wall = time.perf_counter() - start
+
+    for sensor in scanner.created_sensors:
+        print('... {0}: {1} samples in {2:.3f} s ({3:.0f} samples/s)'.format(sensor.address, sensor.samples_emitted, sensor.elapsed, sensor.throughput()))
+    print('... total wall time: {0:.3f} s'.format(wall))
+    print('benchmark_replay end')
+    return scanner.created_sensors
@@ -0,0 +1,176 @@
+import numpy as np
+import threading
+import time
+
+"""
+Sample ring buffer
+
+Fixed-capacity (samples x channels) float32 array that the sensor callback
+copies whole packet blocks into, so live data can be shared with other
+threads without a queue entry per sample or any growth over time.
+
+Samples are addressed by their absolute position since the buffer was
+created: `head` is the position the next sample is written to and `oldest`
+the first one still held. Consumers read the `latest(n)` samples, an absolute
+`read(start, stop)` range, or follow the stream with a `RingReader` that
+remembers its position. `write_time` is the perf_counter time of the latest
+write, so consumers can tell how long ago the newest sample arrived.
+
+In 'overwrite' mode a write never waits: once the buffer is full the oldest
+samples are replaced, and those nobody released yet are counted as
+`overwritten`. In 'backpressure' mode the writer waits up to `timeout`
+seconds for a consumer to `release` space, and samples that still don't fit
+are rejected and counted as `dropped`.
+"""
+OVERWRITE = 'overwrite'
+BACKPRESSURE = 'backpressure'
+
+class RingBuffer:
+    def __init__(self, capacity, channels, dtype=np.float32, mode=OVERWRITE, timeout=0.0):
+        """
+        Parameters:
+            capacity (int): Number of samples held.
+            channels (int): Number of columns per sample.
+            dtype: Sample type, float32 by default.
+            mode (str): 'overwrite' or 'backpressure'.
+            timeout (float): Seconds a write waits for space in 'backpressure' mode.
+        """
+        if mode not in (OVERWRITE, BACKPRESSURE):
+            raise ValueError(f"Unknown ring buffer mode '{mode}', expected '{OVERWRITE}' or '{BACKPRESSURE}'.")
+        self.capacity = capacity
+        self.channels = channels
+        self.mode = mode
+        self.timeout = timeout
+
+        self.head = 0
+        self.released = 0
+        self.dropped = 0
+        self.overwritten = 0
+        self.high_water_mark = 0
+        self.write_time = None
+
+        self._data = np.zeros((capacity, channels), dtype=dtype)
+        self._changed = threading.Condition()
+
+    @property
+    def oldest(self):
+        return max(0, self.head - self.capacity)
+
+    def __len__(self):
+        return self.head - self.oldest
+
+    def pending(self):
+        """Samples written but not released yet."""
+        return self.head - max(self.released, self.oldest)
+
+    def write(self, block):
+        """Append a (samples x channels) block. Returns the number of samples stored."""
+        block = np.asarray(block)
+        if block.ndim != 2 or block.shape[1] != self.channels:
+            raise ValueError(f"Expected a block with {self.channels} columns, got shape {block.shape}.")
+
+        with self._changed:
+            count = len(block)
+            if self.mode == BACKPRESSURE:
+                if self.pending() + count > self.capacity and self.timeout:
+                    self._changed.wait_for(lambda: self.pending() + count <= self.capacity, self.timeout)
+                count = min(count, self.capacity - self.pending())
+                self.dropped += len(block) - count
+                block = block[:count]
+            else:
+                self.overwritten += max(0, self.pending() + count - self.capacity)
+                if count > self.capacity:
+                    # Only the newest samples of an oversized block can be kept
+                    self.head += count - self.capacity
+                    block = block[-self.capacity:]
+                    count = self.capacity
+
+            if count:
+                self._copy_in(block, self.head)
+                self.head += count
+                self.write_time = time.perf_counter()
+                self.high_water_mark = max(self.high_water_mark, self.pending())
+                self._changed.notify_all()
+            return count
+
+    def _copy_in(self, block, position):
+        start = position % self.capacity
+        first = min(len(block), self.capacity - start)
+        self._data[start:start + first] = block[:first]
+        self._data[:len(block) - first] = block[first:]
+
+    def _copy_out(self, start, stop):
+        if stop <= start:
+            return self._data[:0].copy()
+        first, last = start % self.capacity, (stop - 1) % self.capacity + 1
+        if first < last:
+            return self._data[first:last].copy()
+        return np.concatenate([self._data[first:], self._data[:last]])
+
+    def read(self, start, stop=None):
+        """Copy of the samples at positions [start, stop), `stop` defaulting to `head`. Overwritten samples are left out."""
+        with self._changed:
+            stop = self.head if stop is None else min(stop, self.head)
+            return self._copy_out(max(start, self.oldest), stop)
+
+    def latest(self, count):
+        """Copy of the `count` newest samples, fewer if the buffer holds less."""
+        with self._changed:
+            return self._copy_out(max(self.head - count, self.oldest), self.head)
+
+    def release(self, position):
+        """Mark the samples before `position` as consumed, making room for writes in 'backpressure' mode."""
+        with self._changed:
+            if position > self.released:
+                self.released = min(position, self.head)
+                self._changed.notify_all()
+
+    def wait(self, position, timeout=None):
+        """Wait until samples past `position` are available. Returns False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.head > position, timeout)
+
+    def reader(self, release=False, position=None):
+        """RingReader following the stream from `position`, by default the current head."""
+        return RingReader(self, self.head if position is None else position, release)
+
+    def stats(self):
+        return {
+            'samples_written': self.head,
+            'samples_dropped': self.dropped,
+            'samples_overwritten': self.overwritten,
+            'high_water_mark': self.high_water_mark,
+        }
+
+class RingReader:
+    """Cursor over a RingBuffer handing out the samples written since its last read."""
+    def __init__(self, buffer, position, release=False):
+        self.buffer = buffer
+        self.position = position
+        self.release = release
+        self.skipped = 0
+        self.arrival = None  # write_time of the newest sample read so far
+
+    def available(self):
+        return self.buffer.head - self.position
+
+    def read(self, max_samples=None, timeout=None):
+        """
+        New samples since the last read, at most `max_samples`, waiting up to `timeout`
+        seconds for some if there are none yet. Samples overwritten before they could be
+        read are skipped and counted in `skipped`.
+        """
+        if timeout is not None and not self.available():
+            self.buffer.wait(self.position, timeout)
+
+        with self.buffer._changed:
+            start = max(self.position, self.buffer.oldest)
+            stop = self.buffer.head if max_samples is None else min(self.buffer.head, start + max_samples)
+            self.skipped += start - self.position
+            data = self.buffer._copy_out(start, stop)
+            if stop == self.buffer.head and stop > self.position:
+                self.arrival = self.buffer.write_time
+            self.position = stop
+        if self.release:
+            self.buffer.release(stop)
+        return data
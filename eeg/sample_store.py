@@ -0,0 +1,169 @@
+import io
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+from eeg.batched_writer import CsvSink
+
+"""
+Binary sample store
+
+Append-only file of little-endian float32 samples, one row per sample and one
+column per channel, preceded by a small header:
+
+    magic     4 bytes   b'DBSS'
+    version   uint16
+    length    uint32    size of the JSON metadata that follows
+    metadata  JSON      sample_rate, channels, filters
+    padding   zeros up to the next multiple of HEADER_ALIGNMENT
+
+The sample block starts at an aligned offset so it can be opened zero-copy
+with `np.memmap`. Files ending in `.csv` are still accepted everywhere a
+sample store is, so CSV remains available as an export format.
+"""
+MAGIC = b'DBSS'
+VERSION = 1
+DTYPE = np.dtype('<f4')
+HEADER_ALIGNMENT = 64
+_PREFIX = struct.Struct('<4sHI')
+
+def is_sample_store(path):
+    return not str(path).endswith('.csv')
+
+def _encode_header(metadata):
+    payload = json.dumps(metadata, sort_keys=True).encode('utf-8')
+    header = _PREFIX.pack(MAGIC, VERSION, len(payload)) + payload
+    padding = -len(header) % HEADER_ALIGNMENT
+    return header + b'\x00' * padding
+
+def read_header(path):
+    """Return the metadata dict of a sample store and the byte offset of its sample block."""
+    with open(path, 'rb') as file:
+        prefix = file.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"{path} is not a sample store (file too short).")
+        magic, version, length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a sample store (bad magic {magic!r}).")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported sample store version {version}.")
+        metadata = json.loads(file.read(length).decode('utf-8'))
+    size = _PREFIX.size + length
+    return metadata, size + (-size % HEADER_ALIGNMENT)
+
+class SampleStoreWriter:
+    """Append rows to a sample store, creating it with a header if it doesn't exist yet."""
+    def __init__(self, path, channels, sample_rate, filters=None, mode='a'):
+        self.path = path
+        self.channels = list(channels)
+        self.metadata = {
+            'sample_rate': sample_rate,
+            'channels': self.channels,
+            'filters': filters or {},
+        }
+
+        if mode == 'a' and os.path.exists(path) and os.path.getsize(path) > 0:
+            existing, _ = read_header(path)
+            if existing['channels'] != self.channels:
+                raise ValueError(f"{path} has channels {existing['channels']}, expected {self.channels}.")
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(_encode_header(self.metadata))
+
+    def write_rows(self, rows):
+        block = np.asarray(rows, dtype=DTYPE)
+        if block.ndim != 2 or block.shape[1] != len(self.channels):
+            raise ValueError(f"Expected rows with {len(self.channels)} columns, got shape {block.shape}.")
+        self._file.write(block.tobytes())
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def create_sink(path, channels, sample_rate, filters=None, mode='a'):
+    """Open a writer sink for `path`: a sample store, or a headerless CSV for `.csv` paths."""
+    if is_sample_store(path):
+        return SampleStoreWriter(path, channels, sample_rate, filters=filters, mode=mode)
+    return CsvSink(path, mode=mode)
+
+def open_samples(path):
+    """Map the samples of a store into memory as a read-only (samples x channels) float32 array."""
+    metadata, offset = read_header(path)
+    channels = len(metadata['channels'])
+    rows = (os.path.getsize(path) - offset) // (DTYPE.itemsize * channels)
+    if rows == 0:
+        return np.empty((0, channels), dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode='r', offset=offset, shape=(rows, channels))
+
+def load_samples(path, header=None):
+    """
+    Load samples from a sample store or a CSV file as a (samples x channels) array.
+
+    Parameters:
+        path (str): Path to a sample store, or to a CSV file.
+        header (int or None): Passed to `pd.read_csv` for CSV files; ignored for sample stores.
+    """
+    if is_sample_store(path):
+        return open_samples(path)
+    return pd.read_csv(path, header=header).to_numpy()
+
+def iter_samples(path, chunk_size, header=None):
+    """
+    Yield the samples of a sample store or CSV file as consecutive (rows x channels) blocks.
+
+    Sample stores are sliced from the memory map, CSV files are parsed `chunk_size` rows at a time,
+    so neither has to fit in memory.
+    """
+    if is_sample_store(path):
+        data = open_samples(path)
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+    else:
+        for chunk in pd.read_csv(path, header=header, chunksize=chunk_size):
+            yield chunk.to_numpy()
+
+def _tail_lines(path, count, skip_first):
+    # Read backwards from the end of the file until `count` complete lines are buffered
+    block_size = 65536
+    with open(path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0 and data.rstrip().count(b'\n') < count + 1:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+    lines = data.rstrip().splitlines()
+    if position == 0 and skip_first:
+        lines = lines[1:]
+    elif position > 0:
+        lines = lines[1:]  # Possibly cut off at the start of the read
+    return lines[-count:] if count else []
+
+def tail_samples(path, count, header=None):
+    """
+    Return the last `count` samples of a sample store or CSV file, like `load_samples(path, header)[-count:]`.
+
+    CSV files are read backwards from the end, so only the rows returned are parsed.
+    """
+    if is_sample_store(path):
+        data = open_samples(path)
+        return data[max(0, len(data) - count):]
+    lines = _tail_lines(path, count, skip_first=header is not None)
+    if not lines:
+        return load_samples(path, header=header)[:0]
+    return pd.read_csv(io.BytesIO(b'\n'.join(lines)), header=None).to_numpy()
+
+def channel_names(path):
+    return read_header(path)[0]['channels']
+
+def export_csv(input_file, output_file, header=False):
+    """Export a sample store as CSV, optionally with the channel names as the header row."""
+    data = open_samples(input_file)
+    columns = channel_names(input_file) if header else None
+    pd.DataFrame(data, columns=columns).to_csv(output_file, index=False, header=header)
+    print(f"... samples exported to {output_file}")
@@ -1,34 +1,83 @@
+import eeg.band_power
 import eeg.collect_filtered_data
 import eeg.interpolate_data
 import nfc_tag.read_uuid
+import os
 import processing.create_audio
 import processing.create_audio_dark
 import processing.create_quadrant_animation
 import processing.create_radar_animation
-import processing.create_radar_animation
+import processing.live_preview
 import upload.upload_artifacts
-import time
+from pipeline.cache import ArtifactCache
+from pipeline.scheduler import Stage, run_pipeline
 
-FILE_DATA_FILTERED = 'data/data_filtered.csv'
-FILE_DATA_INTERPOLATED = 'data/data_interpolated.csv'
+FILE_DATA_FILTERED = 'data/data_filtered.bin'
+FILE_DATA_INTERPOLATED = 'data/data_interpolated.bin'
+FILE_BAND_POWER = 'data/band_power.bin'
+FILE_BAND_POWER_AUDIO = 'data/band_power_audio.bin'
 FILE_RADAR_ANIMATION = 'artifacts/radar_animation.mp4'
 FILE_QUADRANT_ANIMATION = 'artifacts/quadrant_animation.mp4'
 FILE_AUDIO = 'artifacts/audio.mid'
 FILE_AUDIO_NEW = 'artifacts/audio-dark.mid'
+LIVE_PREVIEW = False  # Show the quadrant view while recording
+# Headsets recorded at once, None for the first one found and any found right after it,
+# eeg.collect_filtered_data.ALL_SENSORS for every one found while scanning. Only the first
+# one's recording (FILE_DATA_FILTERED) is turned into artifacts for the visitor's UUID,
+# the others are kept next to it as data_filtered_2.bin, data_filtered_3.bin, ...
+SENSOR_COUNT = None
+BAND_POWER = False  # Animate and sonify band-power frames instead of raw samples
+# Processes rendering radar segments in parallel. The quadrant and both audio stages run next to the
+# radar stage in the pipeline's pool, so it only gets the cores they leave free (1 renders serially)
+RADAR_WORKERS = max(1, (os.cpu_count() or 1) - 3)
+
+# Artifact generation as a dependency graph, independent stages run in parallel
+STAGES = [
+    Stage('interpolate_data', eeg.interpolate_data.interpolate_to_16_columns,
+          inputs=[FILE_DATA_FILTERED], outputs=[FILE_DATA_INTERPOLATED]),
+    Stage('radar_animation', processing.create_radar_animation.run_radar_animation,
+          inputs=[FILE_DATA_INTERPOLATED], outputs=[FILE_RADAR_ANIMATION], kwargs={'workers': RADAR_WORKERS}),
+    Stage('quadrant_animation', processing.create_quadrant_animation.run_quadrant_animation,
+          inputs=[FILE_DATA_INTERPOLATED], outputs=[FILE_QUADRANT_ANIMATION]),
+    Stage('audio', processing.create_audio.create_audio,
+          inputs=[FILE_DATA_FILTERED], outputs=[FILE_AUDIO]),
+    Stage('audio_dark', processing.create_audio_dark.create_audio,
+          inputs=[FILE_DATA_FILTERED], outputs=[FILE_AUDIO_NEW, processing.create_audio_dark.MP3_FILE],
+          args=[FILE_DATA_FILTERED, FILE_AUDIO_NEW]),
+]
+
+# The same artifacts from 10 band-power frames per second of signal instead of every sample
+BAND_POWER_STAGES = [
+    Stage('band_power', eeg.band_power.compute_band_power,
+          inputs=[FILE_DATA_FILTERED], outputs=[FILE_BAND_POWER, FILE_BAND_POWER_AUDIO]),
+    Stage('radar_animation', processing.create_radar_animation.run_radar_animation,
+          inputs=[FILE_BAND_POWER], outputs=[FILE_RADAR_ANIMATION], kwargs={'workers': RADAR_WORKERS}),
+    Stage('quadrant_animation', processing.create_quadrant_animation.run_quadrant_animation,
+          inputs=[FILE_BAND_POWER], outputs=[FILE_QUADRANT_ANIMATION], kwargs={'view': 1.0}),
+    Stage('audio', processing.create_audio.create_audio,
+          inputs=[FILE_BAND_POWER_AUDIO], outputs=[FILE_AUDIO]),
+    Stage('audio_dark', processing.create_audio_dark.create_audio,
+          inputs=[FILE_BAND_POWER_AUDIO], outputs=[FILE_AUDIO_NEW, processing.create_audio_dark.MP3_FILE],
+          args=[FILE_BAND_POWER_AUDIO, FILE_AUDIO_NEW]),
+]
 
-# Read uuid
-uuid = nfc_tag.read_uuid.read_uuid()
+if __name__ == '__main__':
+    # Read uuid
+    uuid = nfc_tag.read_uuid.read_uuid()
 
-# # Read and preprocess data
-eeg.collect_filtered_data.collect_filtered_data()
-time.sleep(30)
-eeg.interpolate_data.interpolate_to_16_columns(FILE_DATA_FILTERED, FILE_DATA_INTERPOLATED)
+    # # Read and preprocess data
+    if LIVE_PREVIEW:
+        processing.live_preview.run_live_preview('quadrant', FILE_DATA_FILTERED, sensor_count=SENSOR_COUNT)
+    else:
+        collection = eeg.collect_filtered_data.start_collection(FILE_DATA_FILTERED, sensor_count=SENSOR_COUNT)
+        collection.result()
 
-# Create artifacts
-processing.create_radar_animation.run_radar_animation(FILE_DATA_INTERPOLATED, FILE_RADAR_ANIMATION)
-processing.create_quadrant_animation.run_quadrant_animation(FILE_DATA_INTERPOLATED, FILE_QUADRANT_ANIMATION)
-processing.create_audio.create_audio(FILE_DATA_FILTERED,FILE_AUDIO)
-processing.create_audio_dark.create_audio(FILE_DATA_FILTERED, FILE_AUDIO_NEW)
+    # Interpolate and create artifacts, reusing the ones whose inputs, code and parameters are unchanged,
+    # and upload every artifact as soon as its stage finishes
+    cache = ArtifactCache()
+    uploads = upload.upload_artifacts.UploadQueue(uuid)
+    run_pipeline(BAND_POWER_STAGES if BAND_POWER else STAGES, cache=cache, on_stage_done=uploads.publish_stage)
+    print(f"... artifact cache: {cache.stats()}")
 
-# Upload artifacts
-upload.upload_artifacts.upload_artifacts(uuid)
\ No newline at end of file
+    # Wait for the remaining uploads
+    uploads.close()
@@ -0,0 +1,112 @@
+import time
+import ndef
+
+"""
+Mock PC/SC connection
+
+Stand-in for a pyscard connection to an NFC reader holding a Type 2 tag
+(NTAG215 layout: 135 blocks of 4 bytes, user memory from block 4). It
+answers the GET UID, READ BINARY and UPDATE BINARY APDUs the nfc_tag
+scripts send, counts them and optionally waits `latency` seconds per APDU
+to model the reader round trip, so read and write paths can be exercised
+and benchmarked without hardware.
+
+    connection = MockConnection(tag_memory("https://digitalbrain.techschool.lu/user/<uuid>"))
+"""
+BLOCKS = 135
+BLOCK_SIZE = 4
+APDU_LATENCY = 0.008  # Typical round trip of a USB PC/SC reader
+
+SW_OK = (0x90, 0x00)
+SW_WRONG_LENGTH = (0x67, 0x00)
+SW_OUT_OF_RANGE = (0x6A, 0x82)
+SW_NOT_SUPPORTED = (0x6A, 0x81)
+
+def ndef_tlv(url):
+    """NDEF TLV holding a single URI record, followed by a terminator TLV."""
+    message = b''.join(ndef.message_encoder([ndef.UriRecord(url)]))
+    if len(message) < 0xFF:
+        header = bytes([0x03, len(message)])
+    else:
+        header = bytes([0x03, 0xFF]) + len(message).to_bytes(2, 'big')
+    return header + message + b'\xFE'
+
+def tag_memory(url=None, blocks=BLOCKS):
+    """Memory image of a formatted tag, holding an NDEF URI record if `url` is given, else an empty NDEF message."""
+    memory = bytearray(blocks * BLOCK_SIZE)
+    memory[12:16] = bytes([0xE1, 0x10, (blocks - 4) * BLOCK_SIZE // 8, 0x00])  # Capability container
+    tlv = ndef_tlv(url) if url else b'\x03\x00\xFE'
+    memory[16:16 + len(tlv)] = tlv
+    return memory
+
+class MockConnection:
+    def __init__(self, memory=None, uid=b'\x04\x52\x9a\x12\x6c\x70\x80', multi_block_read=True, bulk_read=False, latency=0.0):
+        """
+        Parameters:
+            memory (bytearray): Tag memory image, see `tag_memory`.
+            uid (bytes): Tag UID returned by GET UID.
+            multi_block_read (bool): Whether 16-byte reads are supported, else only 4-byte ones.
+            bulk_read (bool): Whether reads of any whole number of blocks are supported.
+            latency (float): Seconds each APDU takes.
+        """
+        self.memory = bytearray(tag_memory() if memory is None else memory)
+        self.uid = uid
+        self.multi_block_read = multi_block_read
+        self.bulk_read = bulk_read
+        self.latency = latency
+        self.apdus = 0
+        self.connected = False
+
+    def connect(self, *args, **kwargs):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def transmit(self, apdu):
+        self.apdus += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        cla, ins, p1, p2 = apdu[:4]
+        if cla != 0xFF:
+            return [], *SW_NOT_SUPPORTED
+        if ins == 0xCA:
+            return list(self.uid), *SW_OK
+
+        offset = p2 * BLOCK_SIZE
+        if ins == 0xB0:
+            length = apdu[4]
+            if self.bulk_read:
+                supported = length > 0 and length % BLOCK_SIZE == 0
+            else:
+                supported = length == BLOCK_SIZE or (self.multi_block_read and length == 4 * BLOCK_SIZE)
+            if not supported:
+                return [], *SW_WRONG_LENGTH
+            if offset + length > len(self.memory):
+                return [], *SW_OUT_OF_RANGE
+            return list(self.memory[offset:offset + length]), *SW_OK
+        if ins == 0xD6:
+            data = apdu[5:5 + apdu[4]]
+            if apdu[4] != BLOCK_SIZE or len(data) != BLOCK_SIZE:
+                return [], *SW_WRONG_LENGTH
+            if p2 < 4 or offset + BLOCK_SIZE > len(self.memory):
+                return [], *SW_OUT_OF_RANGE
+            self.memory[offset:offset + BLOCK_SIZE] = bytes(data)
+            return [], *SW_OK
+        return [], *SW_NOT_SUPPORTED
+
+def benchmark_read(url="https://digitalbrain.techschool.lu/user/7d9f2b4e-3c1a-4e8b-9f6d-2a5c8e1b0d47", latency=APDU_LATENCY, repeat=10):
+    """Report APDUs and wall time per tag read, with and without 16-byte reads."""
+    from nfc_tag.read_uuid import extract_url, read_ndef_message
+
+    print('benchmark_read start')
+    for multi_block_read in (True, False):
+        connection = MockConnection(tag_memory(url), multi_block_read=multi_block_read, latency=latency)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            found = extract_url(read_ndef_message(connection))
+        wall = (time.perf_counter() - start) / repeat
+        print('... {0}-byte reads: {1:.0f} APDUs, {2:.1f} ms per read, {3}'.format(
+            16 if multi_block_read else 4, connection.apdus / repeat, wall * 1000, 'ok' if found == url else 'MISMATCH'))
+    print('benchmark_read end')
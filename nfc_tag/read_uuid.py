@@ -1,4 +1,8 @@
+from smartcard.CardMonitoring import CardMonitor, CardObserver
+from smartcard.Exceptions import CardConnectionException, NoCardException, NoReadersException
 from smartcard.System import readers
+import ndef
+import queue
 import re
 import time
 
@@ -24,39 +28,98 @@ Windows
 4. Install all requirements by running `pip install -r requirements.txt` inside this project
 '''
 
-URI_PREFIX = "https://"
-
 UUID_V4_REGEX = re.compile(
     r"[a-f0-9]{8}-[a-f0-9]{4}-4[a-f0-9]{3}-[89ab][a-f0-9]{3}-[a-f0-9]{12}"
 )
 
-def read_ndef_message(connection, start_block=4, max_blocks=36):
-    """Read NDEF message starting from block 4 up to max_blocks."""
-    data = []
-    for block in range(start_block, max_blocks):
-        READ_CMD = [0xFF, 0xB0, 0x00, block, 0x04]
-        response, sw1, sw2 = connection.transmit(READ_CMD)
-        if sw1 == 0x90 and sw2 == 0x00:
-            data.extend(response)
-        else:
-            print(f"❌ Failed to read block {block}, status: {sw1:02X} {sw2:02X}")
-            break
-    return data
-
-def extract_url(data):
+# Type 2 tag memory: 4-byte blocks (pages), user data starting at block 4
+NDEF_START_BLOCK = 4
+MAX_BLOCKS = 36
+BLOCK_SIZE = 4
+READ_SIZE = 16  # A Type 2 READ returns four blocks at once
+
+NULL_TLV = 0x00
+NDEF_TLV = 0x03
+TERMINATOR_TLV = 0xFE
+
+def read_binary(connection, block, length):
+    """READ BINARY of `length` bytes from `block`, or None if the reader refuses it."""
+    response, sw1, sw2 = connection.transmit([0xFF, 0xB0, 0x00, block, length])
+    if sw1 == 0x90 and sw2 == 0x00 and len(response) == length:
+        return bytes(response)
+    return None
+
+def find_ndef_tlv(data):
+    """
+    Return (offset, length) of the NDEF message in the TLV area `data`, or None if `data`
+    ends before the NDEF TLV header. The offset may point past the end of `data`.
+
+    A terminator TLV ahead of any NDEF TLV ends the TLV area, which is returned as an empty
+    message at the terminator's position.
+    """
+    position = 0
+    while position < len(data):
+        tlv_type = data[position]
+        if tlv_type == NULL_TLV:
+            position += 1
+            continue
+        if tlv_type == TERMINATOR_TLV:
+            return position, 0
+        if position + 1 >= len(data):
+            return None
+
+        # One-byte length, or 0xFF followed by a two-byte length
+        length, header = data[position + 1], 2
+        if length == 0xFF:
+            if position + 3 >= len(data):
+                return None
+            length, header = int.from_bytes(data[position + 2:position + 4], 'big'), 4
+        if tlv_type == NDEF_TLV:
+            return position + header, length
+        position += header + length  # Lock / memory control or proprietary TLV
+    return None
+
+def read_ndef_message(connection, start_block=NDEF_START_BLOCK, max_blocks=MAX_BLOCKS):
+    """
+    Read the NDEF message of a Type 2 tag.
+
+    The TLVs are parsed as the blocks come in, and once the NDEF TLV header turns up its length
+    tells which blocks still hold the message, so only those are fetched: four at a time, or one
+    at a time if the reader doesn't support 16-byte reads. Nothing past block `max_blocks` is
+    read. Returns the message bytes, or an empty bytes object if the tag holds no NDEF message.
+    """
+    capacity = (max_blocks - start_block) * BLOCK_SIZE
+    read_size = READ_SIZE
+    data = b''
+    tlv = None
+    while tlv is None or len(data) < sum(tlv):
+        if len(data) >= capacity or (tlv is not None and sum(tlv) > capacity):
+            print(f"⚠️ No complete NDEF message within block {max_blocks}")
+            return b''
+        block = start_block + len(data) // BLOCK_SIZE
+        chunk = read_binary(connection, block, min(read_size, capacity - len(data)))
+        if chunk is None and read_size != BLOCK_SIZE:
+            read_size = BLOCK_SIZE
+            chunk = read_binary(connection, block, read_size)
+        if chunk is None:
+            print(f"❌ Failed to read block {block}")
+            return b''
+        data += chunk
+        if tlv is None:
+            # Control TLVs ahead of the NDEF TLV are skipped by their length, not by their content
+            tlv = find_ndef_tlv(data)
+
+    offset, length = tlv
+    return data[offset:offset + length]
+
+def extract_url(message):
+    """URI of the first URI record in an NDEF message."""
     try:
-        # Find start of NDEF URI record
-        if 0x55 in data:
-            index = data.index(0x55)
-            url_bytes = bytes(data[index + 2:])
-
-            # Clean out trailing 0x00 or 0xFE
-            url_bytes = url_bytes.split(b'\xFE')[0].rstrip(b'\x00')
-
-            url = URI_PREFIX + url_bytes.decode("utf-8", errors="ignore")
-            return url
+        for record in ndef.message_decoder(message):
+            if isinstance(record, ndef.UriRecord):
+                return record.uri
         return None
-    except Exception as e:
+    except ndef.DecodeError as e:
         print(f"⚠️ Error extracting URL: {e}")
         return None
 
@@ -64,45 +127,129 @@ def extract_uuid(url):
     match = UUID_V4_REGEX.search(url)
     return match.group(0) if match else None
 
-def read_uuid():
+def read_tag_uuid(connection):
+    """UUID in the URL record of the tag behind `connection`, or None."""
+    print("\n📡 Tag detected. Reading...")
+
+    ndef_data = read_ndef_message(connection)
+    if not ndef_data:
+        print("⚠️ No NDEF data found.")
+
+    url = extract_url(ndef_data)
+    if not url:
+        print("⚠️ No URL found in NDEF data.")
+        return None
+
+    print(f"🌍 URL: {url}")
+    uuid = extract_uuid(url)
+    if not uuid:
+        print("⚠️ No valid UUID found in the URL.")
+    return uuid
+
+class ReaderService(CardObserver):
+    """
+    Wait for tags on one reader without polling.
+
+    pyscard's CardMonitor watches the readers through PC/SC status change notifications in a
+    background thread and reports every inserted card to this observer, which queues the ones on
+    our reader. The monitor, and with it the PC/SC context, stays open for the life of the
+    service, so consecutive sessions don't set it up again. A tag already on the reader when the
+    service starts is reported straight away.
+    """
+    def __init__(self, reader=None):
+        available = readers()
+        if not available:
+            raise NoReadersException()
+        self.reader = reader or available[0]
+        self.tags = queue.Queue()
+        self.monitor = CardMonitor()
+        self.monitor.addObserver(self)
+
+    def update(self, observable, actions):
+        added, removed = actions
+        for card in added:
+            if str(card.reader) == str(self.reader):
+                self.tags.put(card)
+
+    def wait_for_tag(self, timeout=None):
+        """
+        Block until a tag is put on the reader and return a connection to it, or None after `timeout` seconds.
+
+        Tags that are gone again before they could be connected to are skipped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                card = self.tags.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            try:
+                connection = card.createConnection()
+                connection.connect()
+                return connection
+            except (CardConnectionException, NoCardException) as e:
+                # Typically the tag was lifted right after it was tapped
+                print(f"⚠️ Failed to connect to tag ({e})")
+
+    def clear(self):
+        """Forget tags put on the reader before now, so only new taps are returned."""
+        while True:
+            try:
+                self.tags.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.monitor.deleteObserver(self)
+
+_service = None
+
+def reader_service():
+    """The reader service shared by every read_uuid call."""
+    global _service
+    if _service is None:
+        _service = ReaderService()
+    return _service
+
+def read_uuid(timeout=None, service=None):
     '''
     Select the first available NFC reader.
 
     In the case of the black reader: 
     The first reader is the NFC reader ("Generic EMV Smartcard Reader 0")
     The second reader is the smart card reader ("Generic EMV Smartcard Reader 01")
+
+    Waits until a tag holding a valid UUID is put on the reader and returns the UUID,
+    or None if none was presented within `timeout` seconds.
+    Raises NoReadersException if there is no reader.
     '''
     print('read_uuid start')
 
-    r = readers()
-    if len(r) == 0:
-        print("... no NFC reader found!")
-        exit()
-
-    print(f"... using NFC reader: {r[0]}")
-
-    try:
-        connection = r[0].createConnection()
-        connection.connect()
-        print("\n📡 Tag detected. Reading...")
-
-        ndef_data = read_ndef_message(connection)
-        if not ndef_data:
-            print("⚠️ No NDEF data found.")
-
-        url = extract_url(ndef_data)
-        if url:
-            print(f"🌍 URL: {url}")
-            uuid = extract_uuid(url)
-            if uuid:
-                print('read_uuid end')
-                return uuid
-            else:
-                print("⚠️ No valid UUID found in the URL.")
-        else:
-            print("⚠️ No URL found in NDEF data.")
-
-
-    except Exception as e:
-        print(f"⚠️ Waiting for tag... ({e})")
-        time.sleep(1)
+    if service is not None or _service is not None:
+        # Taps queued during an earlier session are stale, a new service reports the tag on the reader
+        (service or _service).clear()
+    service = service or reader_service()
+    print(f"... using NFC reader: {service.reader}")
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        print("... waiting for tag")
+        connection = service.wait_for_tag(remaining)
+        if connection is None:
+            print(f"... no tag presented within {timeout} s")
+            return None
+
+        try:
+            uuid = read_tag_uuid(connection)
+        except Exception as e:
+            # Typically the tag was taken off the reader too early
+            print(f"⚠️ Failed to read tag ({e})")
+            uuid = None
+        finally:
+            connection.disconnect()
+
+        if uuid:
+            print('read_uuid end')
+            return uuid
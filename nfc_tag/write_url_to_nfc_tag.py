@@ -1,28 +1,31 @@
-from smartcard.System import readers
 from smartcard.util import toHexString
-from smartcard.Exceptions import NoCardException
-import uuid
+from nfc_tag.read_uuid import NDEF_START_BLOCK, READ_SIZE, ReaderService, read_binary
+from collections import deque
+import csv
+import os
+import sys
 import threading
 import time
+import uuid
 
-stop_flag = False
-def wait_for_enter():
-    global stop_flag
-    input("\n🔁 Running in loop mode. Press [Enter] anytime to stop...\n")
-    stop_flag = True
-
-threading.Thread(target=wait_for_enter, daemon=True).start()
+'''
+Provision NFC tags with a Digital Brain URL
 
-r = readers()
-if len(r) == 0:
-    print("❌ No NFC reader found!")
-    exit()
+Run `python -m nfc_tag.write_url_to_nfc_tag [count]` and put tags on the reader one after
+the other; every new tag gets its own UUIDv4 URL. Without a count it runs until [Enter].
 
-reader = r[0]
-print(f"✅ Using NFC reader: {reader}")
+UUIDs and their NDEF TLV payloads are generated ahead of time, tags are picked up from card
+insertion events instead of polling, the blocks are written back to back and verified with
+one read of the whole payload. Every tag is logged to a CSV manifest with its UID, UUID, URL,
+status and time, and the throughput in tags/minute is reported as tags come in.
+'''
 
-previous_uid = None
-wait_counter = 0
+BASE_URL = "https://digitalbrain.techschool.lu/user/"
+URI_PREFIX_CODE = 0x04  # "https://"
+BLOCK_SIZE = 4
+PREPARE_AHEAD = 100
+MANIFEST_FILE = "data/provisioning_manifest.csv"
+MANIFEST_FIELDS = ['time', 'uid', 'uuid', 'url', 'status', 'duration_ms']
 
 def get_uid(connection):
     GET_UID = [0xFF, 0xCA, 0x00, 0x00, 0x00]
@@ -34,63 +37,192 @@ def get_uid(connection):
         return None
     return None
 
-while not stop_flag:
+def build_tlv(url):
+    """NDEF TLV with a single short URI record for `url`, padded to whole blocks."""
+    url_body = url.replace("https://", "")
+    url_bytes = url_body.encode("utf-8")
+    payload = [URI_PREFIX_CODE] + list(url_bytes)
+    payload_length = len(payload)
+
+    ndef_record = [0xD1, 0x01, payload_length, 0x55] + payload
+    tlv = [0x03, len(ndef_record)] + ndef_record + [0xFE]
+    return bytes(tlv + [0x00] * (-len(tlv) % BLOCK_SIZE))
+
+def write_commands(tlv, block_start=NDEF_START_BLOCK):
+    """One UPDATE BINARY APDU per block of `tlv`."""
+    return [
+        [0xFF, 0xD6, 0x00, block_start + i // BLOCK_SIZE, BLOCK_SIZE] + list(tlv[i:i + BLOCK_SIZE])
+        for i in range(0, len(tlv), BLOCK_SIZE)
+    ]
+
+class Payload:
+    def __init__(self):
+        self.uuid = str(uuid.uuid4())
+        self.url = f"{BASE_URL}{self.uuid}"
+        self.tlv = build_tlv(self.url)
+        self.commands = write_commands(self.tlv)
+        self.sent = False  # Whether any block of it may be on a tag
+
+def prepare_payloads(count):
+    return deque(Payload() for _ in range(count))
+
+def write_tag(connection, payload):
+    """Send all write APDUs back to back. Returns the numbers of the blocks that failed."""
+    failed = []
+    payload.sent = True
+    for command in payload.commands:
+        response, sw1, sw2 = connection.transmit(command)
+        if sw1 != 0x90 or sw2 != 0x00:
+            failed.append(command[3])
+    return failed
+
+def read_back(connection, length, block_start=NDEF_START_BLOCK):
+    """
+    Read `length` bytes from `block_start` in one READ BINARY, or in 16-byte reads if the reader
+    refuses, or block by block if it only reads 4 bytes at a time.
+    """
+    data = read_binary(connection, block_start, length)
+    if data is not None:
+        return data
+
+    data = b''
+    read_size = READ_SIZE
+    while len(data) < length:
+        block = block_start + len(data) // BLOCK_SIZE
+        chunk = read_binary(connection, block, read_size)
+        if chunk is None and read_size != BLOCK_SIZE:
+            read_size = BLOCK_SIZE
+            chunk = read_binary(connection, block, read_size)
+        if chunk is None:
+            return None
+        data += chunk
+    return data[:length]
+
+def verify_tag(connection, payload):
+    return read_back(connection, len(payload.tlv)) == payload.tlv
+
+def provision_tag(connection, payload):
+    """Write and verify one tag. Returns 'ok', 'write_failed' or 'verify_failed'."""
+    failed = write_tag(connection, payload)
+    if failed:
+        print(f"❌ Failed to write blocks {failed}")
+        return 'write_failed'
+    if not verify_tag(connection, payload):
+        print("❌ Read-back doesn't match the written payload")
+        return 'verify_failed'
+    return 'ok'
+
+class Manifest:
+    """CSV log of every provisioned tag, appended to and flushed tag by tag."""
+    def __init__(self, path=MANIFEST_FILE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=MANIFEST_FIELDS)
+        if new:
+            self._writer.writeheader()
+
+    def log(self, uid, payload, status, duration):
+        self._writer.writerow({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'uid': uid,
+            'uuid': payload.uuid,
+            'url': payload.url,
+            'status': status,
+            'duration_ms': round(duration * 1000, 1),
+        })
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def provision(count=None, manifest_file=MANIFEST_FILE, service=None, stop=None):
+    """
+    Provision tags as they are put on the reader.
+
+    Parameters:
+        count (int): Stop after this many tags were written successfully, run until `stop` if None.
+        manifest_file (str): CSV file every tag is logged to.
+        service (ReaderService): Source of tag connections, the first reader by default.
+        stop (threading.Event): Ends the run when set.
+
+    Returns the number of tags provisioned successfully.
+    """
+    print('provision start')
+
+    service = service or ReaderService()
+    stop = stop or threading.Event()
+    payloads = prepare_payloads(count or PREPARE_AHEAD)
+    manifest = Manifest(manifest_file)
+    print(f"✅ Using NFC reader: {service.reader}")
+
+    seen = set()
+    written = failures = 0
+    start = None
     try:
-        connection = reader.createConnection()
-        try:
-            connection.connect()
-            uid = get_uid(connection)
-            if uid is None or uid == previous_uid:
-                if wait_counter % 5 == 0:
-                    print("⏳ Waiting for a new tag...")
-                wait_counter += 1
-                time.sleep(1)
+        while not stop.is_set() and (count is None or written < count):
+            try:
+                connection = service.wait_for_tag(timeout=0.5)
+            except Exception as e:
+                # A tag tapped and lifted too quickly must not end the run
+                print(f"⚠️ Failed to connect to tag ({e})")
+                failures += 1
                 continue
+            if connection is None:
+                continue
+
+            tag_start = time.perf_counter()
+            start = start or tag_start
+            try:
+                uid = get_uid(connection)
+                if uid is None:
+                    print("❌ Could not read the tag's UID")
+                    failures += 1
+                    continue
+                if uid in seen:
+                    print("⏳ Tag already written, put a new one on the reader.")
+                    continue
+
+                if not payloads:
+                    payloads = prepare_payloads(PREPARE_AHEAD)
+                payload = payloads[0]
+                try:
+                    status = provision_tag(connection, payload)
+                except Exception as e:
+                    print(f"⚠️ Error: {e}")
+                    status = 'error'
+            finally:
+                connection.disconnect()
+
+            manifest.log(uid, payload, status, time.perf_counter() - tag_start)
+            if payload.sent:
+                # A tag that failed after the writes started may carry the UUID already, so it's never reused
+                payloads.popleft()
+            if status == 'ok':
+                seen.add(uid)
+                written += 1
+                elapsed = time.perf_counter() - start
+                rate = written / elapsed * 60 if elapsed else 0.0
+                print(f"📇 {uid} → {payload.url} ({written} tags, {rate:.1f} tags/min)")
+            else:
+                failures += 1
+    finally:
+        manifest.close()
+
+    elapsed = time.perf_counter() - start if start else 0.0
+    rate = written / elapsed * 60 if elapsed else 0.0
+    print(f"... {written} tags provisioned, {failures} failures in {elapsed:.1f} s ({rate:.1f} tags/min)")
+    print(f"... manifest: {manifest_file}")
+    print('provision end')
+    return written
+
+def wait_for_enter(stop):
+    input("\n🔁 Running in loop mode. Press [Enter] anytime to stop...\n")
+    stop.set()
 
-            wait_counter = 0
-            previous_uid = uid
-            print(f"\n📇 Detected new tag UID: {uid}")
-
-            # Generate and display UUID + URL
-            uuid_str = str(uuid.uuid4())
-            url = f"https://digitalbrain.techschool.lu/user/{uuid_str}"
-
-            print("🧠 Digital Brain Entry")
-            print(f"🔗 UUID: {uuid_str}")
-            print(f"🌍 URL:  {url}\n")
-
-            # Build NDEF URI message
-            uri_prefix_code = 0x04
-            url_body = url.replace("https://", "")
-            url_bytes = url_body.encode("utf-8")
-            payload = [uri_prefix_code] + list(url_bytes)
-            payload_length = len(payload)
-
-            ndef_record = [0xD1, 0x01, payload_length, 0x55] + payload
-            tlv = [0x03, len(ndef_record)] + ndef_record + [0xFE]
-
-            block_start = 4
-            for i in range(0, len(tlv), 4):
-                block = block_start + (i // 4)
-                chunk = tlv[i:i+4]
-                while len(chunk) < 4:
-                    chunk.append(0x00)
-
-                WRITE_CMD = [0xFF, 0xD6, 0x00, block, 0x04] + chunk
-                response, sw1, sw2 = connection.transmit(WRITE_CMD)
-                if sw1 == 0x90 and sw2 == 0x00:
-                    print(f"✅ Wrote block {block}: {toHexString(chunk)}")
-                else:
-                    print(f"❌ Failed to write block {block}, status: {sw1:02X} {sw2:02X}")
-
-            print("📲 Tag written! Remove it and place a new one.\n")
-
-        except NoCardException:
-            time.sleep(0.5)
-            continue
-
-    except Exception as e:
-        print(f"⚠️ Error: {e}")
-        time.sleep(1)
-
-print("\n👋 Exiting loop. All done!")
+if __name__ == '__main__':
+    stop = threading.Event()
+    threading.Thread(target=wait_for_enter, args=(stop,), daemon=True).start()
+    provision(int(sys.argv[1]) if len(sys.argv) > 1 else None, stop=stop)
+    print("\n👋 Exiting loop. All done!")
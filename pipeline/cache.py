@@ -0,0 +1,196 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+"""
+Content-addressed artifact cache
+
+A stage's outputs are stored under a key derived from everything that
+determines them: the bytes of its input files, the source code of the stage
+function's module and of every project module it uses, and the stage's
+arguments. When a pipeline reruns with the same key, the outputs are
+restored from the cache (or left alone if they are already in place) and the
+stage is skipped.
+
+Entries live in `directory/<key>/` next to an `index.json` recording their
+size and last use. When the cache grows beyond `max_bytes`, the least
+recently used entries are evicted.
+"""
+CACHE_DIR = '.artifact_cache'
+MAX_BYTES = 2 * 1024 ** 3
+HASH_CHUNK = 1 << 20
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _project_file(module):
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    if not path.startswith(PROJECT_ROOT + os.sep) or 'site-packages' in path:
+        return None
+    return path
+
+def code_files(func):
+    """Source files of the module defining `func` and of the project modules it uses, transitively."""
+    files = {}
+    pending = [inspect.getmodule(func)]
+    while pending:
+        module = pending.pop()
+        path = _project_file(module) if module else None
+        if path is None or path in files:
+            continue
+        files[path] = module
+        for value in vars(module).values():
+            name = getattr(value, '__module__', None)
+            dependency = value if inspect.ismodule(value) else sys.modules.get(name) if isinstance(name, str) else None
+            if dependency is not None:
+                pending.append(dependency)
+    return sorted(files)
+
+class ArtifactCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, on_lookup=None):
+        """
+        Parameters:
+            directory (str): Where entries and the index are kept.
+            max_bytes (int): Total size of the entries above which the least recently used are evicted.
+            on_lookup (callable): Called as `on_lookup(stage, key, hit)` after every lookup.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.on_lookup = on_lookup
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._code_digests = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self._index_file = os.path.join(directory, 'index.json')
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_file) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        # Forget entries whose directory disappeared
+        return {key: entry for key, entry in index.items() if os.path.isdir(self._entry_dir(key))}
+
+    def _save_index(self):
+        temporary = self._index_file + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self._index, file, indent=1, sort_keys=True)
+        os.replace(temporary, self._index_file)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _code_digest(self, func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        if name not in self._code_digests:
+            digest = hashlib.sha256()
+            for path in code_files(func):
+                digest.update(os.path.relpath(path, PROJECT_ROOT).encode('utf-8'))
+                digest.update(file_digest(path).encode('ascii'))
+            self._code_digests[name] = digest.hexdigest()
+        return self._code_digests[name]
+
+    def key(self, stage):
+        """Cache key of `stage`; its input files must exist."""
+        digest = hashlib.sha256()
+        digest.update(f'{stage.func.__module__}.{stage.func.__qualname__}'.encode('utf-8'))
+        digest.update(self._code_digest(stage.func).encode('ascii'))
+        digest.update(json.dumps([list(stage.outputs), list(stage.args), stage.kwargs], sort_keys=True, default=repr).encode('utf-8'))
+        for path in stage.inputs:
+            digest.update(path.encode('utf-8'))
+            digest.update(file_digest(path).encode('ascii'))
+        return digest.hexdigest()
+
+    def restore(self, stage, key):
+        """Put the cached outputs of `stage` in place. Returns False on a miss."""
+        with self._lock:
+            entry = self._index.get(key)
+            hit = entry is not None and entry['outputs'] == list(stage.outputs)
+            if hit:
+                for path, stored in zip(stage.outputs, entry['files']):
+                    cached = os.path.join(self._entry_dir(key), stored['name'])
+                    if os.path.exists(path) and os.path.getsize(path) == stored['size'] and file_digest(path) == stored['sha256']:
+                        continue
+                    if os.path.dirname(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                    shutil.copyfile(cached, path)
+                entry['last_used'] = time.time()
+                self._save_index()
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if self.on_lookup:
+            self.on_lookup(stage, key, hit)
+        return hit
+
+    def store(self, stage, key):
+        """Copy the outputs of a finished stage into the cache under `key`."""
+        with self._lock:
+            staging = tempfile.mkdtemp(prefix='.store_', dir=self.directory)
+            try:
+                files = []
+                for i, path in enumerate(stage.outputs):
+                    name = f'{i}_{os.path.basename(path)}'
+                    shutil.copyfile(path, os.path.join(staging, name))
+                    files.append({'name': name, 'size': os.path.getsize(path), 'sha256': file_digest(path)})
+
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                os.replace(staging, self._entry_dir(key))
+            except Exception:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+
+            self._index[key] = {
+                'stage': stage.name,
+                'outputs': list(stage.outputs),
+                'files': files,
+                'size': sum(file['size'] for file in files),
+                'last_used': time.time(),
+            }
+            self._evict(keep=key)
+            self._save_index()
+
+    def size(self):
+        return sum(entry['size'] for entry in self._index.values())
+
+    def _evict(self, keep=None):
+        total = self.size()
+        for key in sorted(self._index, key=lambda key: self._index[key]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._index.pop(key)['size']
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            self.evictions += 1
+            print(f"... cache evicted {key[:12]}, {total} bytes in use")
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._index),
+            'bytes': self.size(),
+        }
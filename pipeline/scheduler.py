@@ -0,0 +1,142 @@
+import concurrent.futures
+import os
+import time
+
+"""
+Pipeline scheduler
+
+Stages declare the files they read and write. A stage depends on every stage
+that produces one of its inputs; files no stage produces are expected to
+exist already. Stages whose inputs are ready run concurrently in a process
+pool bounded by the number of cores, and each stage's wall time is reported.
+
+Stage functions and their arguments must be picklable, i.e. module-level
+functions called with plain values.
+
+With an `ArtifactCache` (pipeline/cache.py), a stage whose key is already
+cached has its outputs restored instead of running, and the outputs of every
+stage that runs are stored.
+"""
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=(), args=None, kwargs=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.args = tuple(inputs) + tuple(outputs) if args is None else tuple(args)
+        self.kwargs = kwargs or {}
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+def _run_stage(func, args, kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+def dependencies(stages):
+    """Map each stage name to the names of the stages producing its inputs."""
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"{output} is produced by both {producers[output]} and {stage.name}.")
+            producers[output] = stage.name
+    return {stage.name: {producers[path] for path in stage.inputs if path in producers} for stage in stages}
+
+def run_pipeline(stages, max_workers=None, on_stage_done=None, cache=None):
+    """
+    Run `stages` in dependency order, independent stages in parallel.
+
+    Parameters:
+        stages (list of Stage): The stages to run.
+        max_workers (int): Size of the process pool, defaults to the number of cores.
+        on_stage_done (callable): Called in this process as `on_stage_done(stage, elapsed)` when a stage succeeds
+            or its outputs are restored from the cache (elapsed 0).
+        cache (ArtifactCache): Skip stages whose outputs are cached, cache the outputs of the others.
+
+    Returns a dict mapping stage name to its wall time in seconds, or None if the stage failed
+    or was skipped because a stage it depends on failed.
+    """
+    print('run_pipeline start')
+
+    by_name = {stage.name: stage for stage in stages}
+    waiting_on = dependencies(stages)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(stages)))
+
+    results = {}
+    pending = {}
+    keys = {}
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        def finish(stage, elapsed):
+            results[stage.name] = elapsed
+            if on_stage_done:
+                on_stage_done(stage, elapsed)
+            for deps in waiting_on.values():
+                deps.discard(stage.name)
+
+        def cache_lookup(stage):
+            try:
+                keys[stage.name] = cache.key(stage)
+            except OSError as err:
+                # Missing inputs, let the stage run and report the error itself
+                print(f"... {stage.name} not cached: {err}")
+                return False
+            return cache.restore(stage, keys[stage.name])
+
+        def submit_ready():
+            # Restoring a cached stage can make its dependents ready, so repeat until nothing changes
+            ready = True
+            while ready:
+                ready = [name for name, deps in waiting_on.items() if not deps]
+                for name in ready:
+                    del waiting_on[name]
+                    stage = by_name[name]
+                    if cache is not None and cache_lookup(stage):
+                        print(f"... {name} restored from cache")
+                        finish(stage, 0.0)
+                        continue
+                    print(f"... {name} started")
+                    pending[executor.submit(_run_stage, stage.func, stage.args, stage.kwargs)] = stage
+
+        def skip_dependents(name):
+            for other, deps in list(waiting_on.items()):
+                if name in deps and other in waiting_on:
+                    del waiting_on[other]
+                    results[other] = None
+                    print(f"... {other} skipped, {name} failed")
+                    skip_dependents(other)
+
+        submit_ready()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage = pending.pop(future)
+                try:
+                    elapsed = future.result()
+                except Exception as err:
+                    results[stage.name] = None
+                    print(f"... {stage.name} failed: {err}")
+                    skip_dependents(stage.name)
+                    continue
+
+                print(f"... {stage.name} finished in {elapsed:.2f} s")
+                if stage.name in keys:
+                    try:
+                        cache.store(stage, keys[stage.name])
+                    except OSError as err:
+                        print(f"... {stage.name} outputs not cached: {err}")
+                finish(stage, elapsed)
+            submit_ready()
+
+    for name in waiting_on:
+        results[name] = None
+        print(f"... {name} not run, its inputs are never produced (dependency cycle)")
+
+    print(f"... pipeline finished in {time.perf_counter() - start:.2f} s with {max_workers} workers")
+    print('run_pipeline end')
+    return results
@@ -1,81 +1,59 @@
-import csv
-from midiutil import MIDIFile
-from collections import deque
+import numpy as np
+from eeg.sample_store import tail_samples
+from processing.sonification import Score, compile_session, normalize, shift_high_pitches, write_midi
 
 # Define the threshold for shifting notes above "G7" (MIDI note 103)
 G7_NOTE = 103
 
+# Set the desired number of samples
+MAX_SAMPLES = 500
+NOTE_DURATION = 0.5  # Fixed duration for each note
+
 def adjust_high_pitch(pitch):
     """Shift pitches above G7 down by four octaves (48 semitones)."""
-    if pitch > G7_NOTE:
-        pitch -= 48  # Shift down by four octaves (48 semitones)
-    return pitch
+    return shift_high_pitches(pitch, G7_NOTE)
 
 def normalize_data_to_notes(channel_data):
     """Normalize data to fit MIDI note range (0–127)."""
-    data_min = min(channel_data['O1'])
-    data_max = max(channel_data['O1'])
-    return [
-        int((value - data_min) / (data_max - data_min) * 127)
-        for value in channel_data['O1']
-    ]
+    return normalize(channel_data['O1'])
 
 def normalize_data_to_velocities(channel_data):
     """Normalize a list of data to fit within MIDI velocity range (0-127)."""
-    data_min = min(channel_data['O2'])
-    data_max = max(channel_data['O2'])
-    return [
-        int((value - data_min) / (data_max - data_min) * 127)
-        for value in channel_data['O2']
-    ]
-
-def create_audio(input_file, output_file):
-    print('create_audio start')
-
-    with open(input_file, 'r') as csv_file:
-        reader = csv.reader(csv_file)
-        next(reader, None)
-
-        # Set the desired number of samples
-        max_samples = 500
-        channels = ['O1', 'O2', 'T3', 'T4']
+    return normalize(channel_data['O2'])
 
-        channel_data = {channel: deque(maxlen=max_samples) for channel in channels}
+def compile_score(data):
+    """Notes and tempo changes for a (samples x 4) block of O1, O2, T3, T4 samples."""
+    channels = ['O1', 'O2', 'T3', 'T4']
+    channel_data = {channel: data[:, i] for i, channel in enumerate(channels)}
 
-        for row in reader:
-            if len(row) == len(channels):
-                for i, channel in enumerate(channels):
-                    channel_data[channel].append(float(row[i]))
-
-    pitches = normalize_data_to_notes(channel_data)
+    pitches = adjust_high_pitch(normalize_data_to_notes(channel_data))
     velocities = normalize_data_to_velocities(channel_data)
 
     # Parameters for MIDI generation
     tempo = 120  # Initial tempo
-    duration = 0.5  # Fixed duration for each note
-    channel = 0
-    time = 0
-
-    midi_file = MIDIFile(1)
-    track = 0
+    starts = NOTE_DURATION * np.arange(len(pitches))
 
-    midi_file.addTempo(track, time, tempo)
+    # Dynamic tempo based on T3, one small change per note (could be a more complex function)
+    dynamic_tempos = tempo + np.trunc(channel_data['T3'] * 10).astype(np.int64)
 
-    # Add notes with dynamic tempo adjustments based on T3 and T4
-    for i, (pitch, velocity) in enumerate(zip(pitches, velocities)):
-        pitch = adjust_high_pitch(pitch)
+    # Modify note duration based on T4 (rhythm variation)
+    note_durations = NOTE_DURATION + (channel_data['T4'] * 0.1)  # Small variation in note duration
 
-        # Modify tempo based on T3 (could be a more complex function)
-        dynamic_tempo = tempo + int(channel_data['T3'][i] * 10)  # Small tempo change based on T3
-        midi_file.addTempo(track, time + i * duration, dynamic_tempo)
+    return Score(starts, note_durations, pitches, velocities,
+                 tempo_times=np.append(0, starts), tempos=np.append(tempo, dynamic_tempos))
 
-        # Modify note duration based on T4 (rhythm variation)
-        note_duration = duration + (channel_data['T4'][i] * 0.1)  # Small variation in note duration
-
-        midi_file.addNote(track, channel, pitch, time + i * duration, note_duration, velocity)
+def create_audio(input_file, output_file, full_session=False, workers=None):
+    """
+    Sonify the last MAX_SAMPLES samples of `input_file` into a MIDI file, or with
+    `full_session` the whole recording in windows of MAX_SAMPLES samples.
+    """
+    print('create_audio start')
 
-    with open(output_file, "wb") as file:
-        midi_file.writeFile(file)
+    if full_session:
+        score = compile_session(input_file, compile_score, MAX_SAMPLES, NOTE_DURATION, workers)
+    else:
+        score = compile_score(tail_samples(input_file, MAX_SAMPLES, header=0))
+    write_midi(score, output_file)
 
     print(f"... MIDI file generated: {output_file}")
     print('create_audio start')
@@ -1,13 +1,17 @@
-import csv
 import platform
 import subprocess
-from collections import deque
-from midiutil import MIDIFile
+import numpy as np
+from eeg.sample_store import tail_samples
+from processing.sonification import Score, compile_session, normalize, scale_lookup, shift_high_pitches, write_midi
+from processing.synth import render_mp3
 from pydub import AudioSegment
 
 '''
 Create audio from EEG data using MIDI and convert to MP3
 
+The built-in synthesizer (processing/synth.py) is the default and only needs
+FFmpeg (step 6). The remaining steps set up FluidSynth for backend='fluidsynth'.
+
 MacOS
 1. Install fluidsynth using Homebrew:
    $ brew install fluidsynth
@@ -39,6 +43,9 @@ C7_NOTE = 96
 C1_NOTE = 24
 BASE_TEMPO = 120
 DURATION_BASE = 0.5
+
+# Set the desired number of samples
+MAX_SAMPLES = 500
  
 SCALE = [57, 60, 62, 64, 67, 69, 72, 74]
 EXTENDED_SCALE = [
@@ -53,72 +60,51 @@ WAV_FILE = "artifacts/audio-dark.wav"
 MP3_FILE = "artifacts/audio-dark.mp3"
  
 def adjust_high_pitch(pitch):
-    return pitch - 48 if pitch > C7_NOTE else pitch
+    return shift_high_pitches(pitch, C7_NOTE)
  
+SCALE_LOOKUP = scale_lookup(EXTENDED_SCALE)
+
 def quantize_to_scale(pitch):
-    return min(EXTENDED_SCALE, key=lambda x: abs(x - pitch))
+    return SCALE_LOOKUP[pitch]
  
 def normalize_data(data_list, min_val=0, max_val=127):
-    data_min, data_max = min(data_list), max(data_list)
-    if data_max == data_min:
-        return [int((min_val + max_val) / 2)] * len(data_list)
-    return [
-        int((value - data_min) / (data_max - data_min) * (max_val - min_val) + min_val)
-        for value in data_list
-    ]
- 
-def create_midi(input_file, output_file):
-    print("Creating modular-inspired MIDI...")
+    return normalize(data_list, min_val, max_val)
  
-    with open(input_file, 'r') as csv_file:
-        reader = csv.reader(csv_file)
-        next(reader, None)
+def compile_score(data):
+    """Notes for a (samples x 4) block of O1, O2, T3, T4 samples."""
+    channels = ['O1', 'O2', 'T3', 'T4']
+    channel_data = {channel: data[:, i] for i, channel in enumerate(channels)}
  
-        max_samples = 500
-        channels = ['O1', 'O2', 'T3', 'T4']
-        channel_data = {ch: deque(maxlen=max_samples) for ch in channels}
- 
-        for row in reader:
-            if len(row) == len(channels):
-                for i, channel in enumerate(channels):
-                    channel_data[channel].append(float(row[i]))
- 
-    pitches = normalize_data(channel_data['O1'])
+    pitches = quantize_to_scale(adjust_high_pitch(normalize_data(channel_data['O1'])))
     velocities = normalize_data(channel_data['O2'])
- 
-    midi_file = MIDIFile(1)
-    track, channel, time = 0, 0, 0
- 
-    midi_file.addTempo(track, time, BASE_TEMPO)
- 
-    last_low_note = None
-    note_active = False
- 
-    for i, raw_pitch in enumerate(pitches):
-        pitch = adjust_high_pitch(raw_pitch)
-        pitch = quantize_to_scale(pitch)
- 
-       
-        note_duration = DURATION_BASE + (channel_data['T4'][i] * 0.1)
-        velocity = velocities[i]
- 
-        if pitch < C1_NOTE:
-            # Start or change low note
-            if pitch != last_low_note:
-                last_low_note = pitch
-                midi_file.addNote(track, channel, pitch, time + i * DURATION_BASE, note_duration, velocity)
-                note_active = True
-            else:
-                # Sustain current low note
-                midi_file.addNote(track, channel, last_low_note, time + i * DURATION_BASE, note_duration, velocity)
-        elif last_low_note and note_active:
-            # Sustain previous low note when current note is above C1
-            midi_file.addNote(track, channel, last_low_note, time + i * DURATION_BASE, note_duration, velocity)
- 
-    with open(output_file, "wb") as file:
-        midi_file.writeFile(file)
+    starts = DURATION_BASE * np.arange(len(pitches))
+    note_durations = DURATION_BASE + (channel_data['T4'] * 0.1)
+
+    # Notes below C1 start or change the low note; higher notes sustain the last
+    # low note instead, once there is one (a low note 0 never sustains)
+    low = pitches < C1_NOTE
+    last_low = np.maximum.accumulate(np.where(low, np.arange(len(pitches)), -1))
+    held = pitches[np.maximum(last_low, 0)]
+    notes = np.where(low, pitches, held)
+    sounding = low | ((last_low >= 0) & (held != 0))
+
+    return Score(starts, note_durations, notes, velocities, tempos=[BASE_TEMPO]).select(sounding)
+
+def create_midi(input_file, output_file, full_session=False, workers=None):
+    """
+    Sonify the last MAX_SAMPLES samples of `input_file`, or with `full_session` the whole
+    recording in windows of MAX_SAMPLES samples, each starting without a low note.
+    """
+    print("Creating modular-inspired MIDI...")
+
+    if full_session:
+        score = compile_session(input_file, compile_score, MAX_SAMPLES, DURATION_BASE, workers)
+    else:
+        score = compile_score(tail_samples(input_file, MAX_SAMPLES, header=0))
+    write_midi(score, output_file)
  
     print(f"MIDI file saved: {output_file}")
+    return score
 
 def convert_midi_to_mp3(midi_file, soundfont_path, wav_output, mp3_output):
     # Get the correct executable name (Windows needs .exe)
@@ -139,6 +125,18 @@ def convert_midi_to_mp3(midi_file, soundfont_path, wav_output, mp3_output):
 
     print(f"✅ Done! MP3 saved to: {mp3_output}")
 
-def create_audio(input_file, output_file):
-    create_midi(input_file, output_file)
-    convert_midi_to_mp3(output_file, SOUNDFONT_PATH, WAV_FILE, MP3_FILE)
\ No newline at end of file
+def create_audio(input_file, output_file, backend='builtin', full_session=False):
+    """
+    Write the MIDI file and render it to MP3_FILE.
+
+    backend='builtin' synthesizes the notes in process and streams them to the encoder,
+    backend='fluidsynth' renders the MIDI file with FluidSynth and the SoundFont via WAV_FILE.
+    full_session sonifies the whole recording instead of its last MAX_SAMPLES samples.
+    """
+    score = create_midi(input_file, output_file, full_session)
+    if backend == 'fluidsynth':
+        convert_midi_to_mp3(output_file, SOUNDFONT_PATH, WAV_FILE, MP3_FILE)
+    elif backend == 'builtin':
+        render_mp3(score, MP3_FILE)
+    else:
+        raise ValueError(f"Unknown audio backend: {backend}")
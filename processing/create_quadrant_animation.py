@@ -1,13 +1,28 @@
 import numpy as np
-import pandas as pd
 import pyqtgraph as pg
 import pyqtgraph.exporters
 import cv2
 import os
-from PyQt6 import QtCore, QtWidgets
+from PyQt6 import QtCore, QtGui, QtWidgets
+from eeg.sample_store import load_samples
+from processing import raster
+from processing.quadrant_geometry import QuadrantGeometry
+
+"""
+Quadrant animation
+
+The windowed mode steps through the frames on a 100 ms QTimer, exports every
+frame as a PNG and assembles the video from the PNGs at the end.
+
+The headless mode needs neither a display nor the event loop: it renders the
+frames back to back with Qt's offscreen platform, grabs each one into memory
+and streams it straight into the video writer.
+"""
+FPS = 10
+FRAME_WIDTH = 800
 
 class QuadrantAnimation(QtWidgets.QMainWindow):
-    def __init__(self, input_csv, output_video, image_folder="quadrant_frames"):
+    def __init__(self, input_csv, output_video, image_folder="quadrant_frames", headless=False, view=0.1):
         super().__init__()
 
         self.setWindowTitle("Quadrant Circle Animation")
@@ -16,8 +31,8 @@ class QuadrantAnimation(QtWidgets.QMainWindow):
         self.plot_widget = pg.PlotWidget(title="Quadrants")
         self.plot_widget.setBackground("black")
         self.plot_widget.setAspectLocked()
-        self.plot_widget.setXRange(-0.1, 0.1)  # set scale of graph
-        self.plot_widget.setYRange(-0.1, 0.1)
+        self.plot_widget.setXRange(-view, view)  # set scale of graph
+        self.plot_widget.setYRange(-view, view)
         self.plot_widget.showGrid(x=True, y=True, alpha=0.5)
         self.setCentralWidget(self.plot_widget)
 
@@ -41,46 +56,30 @@ class QuadrantAnimation(QtWidgets.QMainWindow):
         self.buffer_size = 4
         self.image_folder = image_folder
         self.output_video = output_video
-        os.makedirs(self.image_folder, exist_ok=True)
 
         self.load_csv(input_csv)
 
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.update_plot)
-        self.timer.start(100)
+        if headless:
+            # Lay the window out at its full size without ever putting it on screen
+            self.setAttribute(QtCore.Qt.WidgetAttribute.WA_DontShowOnScreen)
+            self.show()
+        else:
+            os.makedirs(self.image_folder, exist_ok=True)
+            self.timer = QtCore.QTimer()
+            self.timer.timeout.connect(self.update_plot)
+            self.timer.start(100)
 
     def load_csv(self, file_name):
         try:
-            df = pd.read_csv(file_name, header=0)
-            self.data = df.to_numpy()
+            self.data = load_samples(file_name, header=0)
         except Exception as e:
             print(f"Error loading CSV file: {e}")
-            self.data = []
+            self.data = np.empty((0, 16))
+        self.geometry = QuadrantGeometry(self.data)
 
     def update_plot(self):
         if self.current_index < len(self.data):
-            row = self.data[self.current_index]
-
-            quadrant_data = {
-                "Q1": row[:len(row)//4],
-                "Q2": row[len(row)//4:len(row)//2],
-                "Q3": row[len(row)//2:3*len(row)//4],
-                "Q4": row[3*len(row)//4:]
-            }
-
-            for quadrant, lines in self.quadrant_lines.items():
-                values = quadrant_data[quadrant]
-                for i, line in enumerate(lines):
-                    if self.current_index - i >= 0:
-                        angles = np.linspace(i * (np.pi / 2), (i + 1) * (np.pi / 2), len(values), endpoint=False)
-                        angles = np.append(angles, angles[0])
-                        values = np.append(values, values[0])
-                        x = values * np.cos(angles)
-                        y = values * np.sin(angles)
-                        line.setData(x, y)
-                    else:
-                        line.clear()
-
+            self.draw_frame(self.current_index)
             self.save_plot(self.current_index)
             self.current_index += 1
         else:
@@ -89,11 +88,49 @@ class QuadrantAnimation(QtWidgets.QMainWindow):
             self.cleanup_images()
             QtWidgets.QApplication.quit()
 
+    def draw_frame(self, index):
+        frame = self.geometry.frame(index)
+        for quadrant, lines in enumerate(self.quadrant_lines.values()):
+            for i, line in enumerate(lines):
+                if index - i >= 0:
+                    line.setData(frame[quadrant, i, :, 0], frame[quadrant, i, :, 1])
+                else:
+                    line.clear()
+
     def save_plot(self, index):
         exporter = pg.exporters.ImageExporter(self.plot_widget.plotItem)
-        exporter.parameters()["width"] = 800
+        exporter.parameters()["width"] = FRAME_WIDTH
         exporter.export(f"{self.image_folder}/quadrant_plot_{index:04d}.png")
 
+    def grab_frame(self, exporter):
+        """Render the plot into memory and return it as a BGR array for OpenCV."""
+        image = exporter.export(toBytes=True).convertToFormat(QtGui.QImage.Format.Format_BGR888)
+        width, height = image.width(), image.height()
+        buffer = image.constBits()
+        buffer.setsize(image.sizeInBytes())
+        rows = np.frombuffer(buffer, dtype=np.uint8).reshape(height, image.bytesPerLine())
+        return np.ascontiguousarray(rows[:, :width * 3].reshape(height, width, 3))
+
+    def render_to_video(self):
+        """Render every frame without a timer and stream it straight into the video writer."""
+        exporter = pg.exporters.ImageExporter(self.plot_widget.plotItem)
+        exporter.parameters()["width"] = FRAME_WIDTH
+
+        video = None
+        for index in range(len(self.data)):
+            self.draw_frame(index)
+            frame = self.grab_frame(exporter)
+            if video is None:
+                height, width, layers = frame.shape
+                video = cv2.VideoWriter(self.output_video, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (width, height))
+            video.write(frame)
+
+        if video is None:
+            print("... no frames found for video generation")
+            return
+        video.release()
+        print(f"... video saved as {self.output_video}")
+
     def generate_video(self):
         images = sorted([img for img in os.listdir(self.image_folder) if img.endswith(".png")])
         if not images:
@@ -102,7 +139,7 @@ class QuadrantAnimation(QtWidgets.QMainWindow):
 
         frame = cv2.imread(os.path.join(self.image_folder, images[0]))
         height, width, layers = frame.shape
-        video = cv2.VideoWriter(self.output_video, cv2.VideoWriter_fourcc(*'mp4v'), 10, (width, height))
+        video = cv2.VideoWriter(self.output_video, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (width, height))
 
         for image in images:
             video.write(cv2.imread(os.path.join(self.image_folder, image)))
@@ -119,11 +156,27 @@ class QuadrantAnimation(QtWidgets.QMainWindow):
                 print(f"Error deleting file {file_path}: {e}")
         print("... all images deleted from quadrant_frames")
 
-def run_quadrant_animation(input_csv, output_video):
+def run_quadrant_animation(input_csv, output_video, headless=True, backend='qt', view=0.1):
+    """
+    Render the quadrant animation of a 16-column sample file to `output_video`.
+
+    `view` is the half width of the plotted range: 0.1 suits filtered samples, 1 suits relative band powers.
+    """
     print('run_quadrant_animation start')
-    app = QtWidgets.QApplication([])
-    quadrant_window = QuadrantAnimation(input_csv, output_video)
-    quadrant_window.show()
-    app.exec()
+    if backend == 'raster':
+        raster.render_quadrant_video(input_csv, output_video, fps=FPS, view=view)
+        print('run_quadrant_animation end')
+        return
+
+    if headless:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    if headless:
+        quadrant_window = QuadrantAnimation(input_csv, output_video, headless=True, view=view)
+        quadrant_window.render_to_video()
+    else:
+        quadrant_window = QuadrantAnimation(input_csv, output_video, view=view)
+        quadrant_window.show()
+        app.exec()
     print('run_quadrant_animation end')
 
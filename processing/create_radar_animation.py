@@ -1,8 +1,15 @@
-import csv
+import concurrent.futures
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import shutil
+import subprocess
+import tempfile
 from collections import deque
 from matplotlib.animation import FuncAnimation
+from eeg.sample_store import load_samples
+from processing import raster
 
 class RadarAnimation:
     def __init__(self, file_path, channels, buffer_size=3):
@@ -12,17 +19,11 @@ class RadarAnimation:
         self.buffer_size = buffer_size
 
     def read_data(self, file_path, channels):
-        channel_data = {channel: [] for channel in channels}
-        with open(file_path, 'r') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader, None)  
-            for row in reader:
-                for i, channel in enumerate(channels):
-                    channel_data[channel].append(float(row[i]))
-        return channel_data
+        """Return the samples as one (frames x channels) array."""
+        return load_samples(file_path, header=0)[:, :len(channels)]
 
     def update(self, frame, ax, lines, fills, buffer):
-        values = [self.data[channel][frame] for channel in self.channels]
+        values = self.data[frame]
         theta = np.linspace(0, 2 * np.pi, len(self.channels) + 1)
         values = np.append(values, values[0])  
 
@@ -44,14 +45,188 @@ class RadarAnimation:
         fills = [ax.fill([], [], alpha=0.2)[0] for _ in range(self.buffer_size)]
         buffer = deque(maxlen=self.buffer_size)
 
-        frames = len(next(iter(self.data.values())))
+        frames = len(self.data)
         return FuncAnimation(fig, self.update, frames=frames, fargs=(ax, lines, fills, buffer), interval=600, blit=False)
 
-def run_radar_animation(input_file, output_file):
+    def prepare_blitted(self):
+        """
+        Precompute everything the blitted renderer needs once.
+
+        The angles and the closed polygon of every frame are computed up front, so a frame
+        only copies values into the existing artists. The radial axis is fixed to the range
+        of the whole recording because blitting cannot redraw rescaled axes.
+        """
+        self.theta = np.linspace(0, 2 * np.pi, len(self.channels) + 1)
+        self.closed = np.empty((len(self.data), len(self.channels) + 1))
+        self.closed[:, :-1] = self.data
+        self.closed[:, -1] = self.data[:, 0]
+
+        self.rmin, self.rmax = raster.radial_limits(self.data)
+
+    def update_blitted(self, frame, lines, fills, polygons, buffer):
+        buffer.append(frame)  # Maintain only last `buffer_size` frame indices
+
+        for i, index in enumerate(buffer):
+            values = self.closed[index]
+            lines[i].set_data(self.theta, values)
+            polygons[i][:, 1] = values
+            fills[i].set_xy(polygons[i])
+
+        return fills + lines
+
+    def setup_blitted_figure(self):
+        self.prepare_blitted()
+
+        fig, ax = plt.subplots(figsize=(8, 8), subplot_kw={'polar': True})
+        ax.set_xticks(self.theta[:-1])
+        ax.set_xticklabels(self.channels, fontsize=10)
+        ax.set_ylim(self.rmin, self.rmax)
+        ax.set_autoscale_on(False)
+
+        lines = [ax.plot([], [], marker='o', lw=2, animated=True)[0] for _ in range(self.buffer_size)]
+        fills = [ax.fill([], [], alpha=0.2 * (i + 1), color=f"C{i}", animated=True)[0] for i in range(self.buffer_size)]
+        polygons = [np.column_stack([self.theta, np.zeros_like(self.theta)]) for _ in range(self.buffer_size)]
+        return fig, ax, lines, fills, polygons
+
+    def create_blitted_animation(self, frames=None, buffer=None):
+        """
+        Create an animation for interactive display with persistent artists that are updated in place and blitted.
+
+        Parameters:
+            frames (iterable): Frame indices to render, defaults to every frame.
+            buffer (deque): Frame indices already shown, to warm up the history when
+                rendering a segment that doesn't start at frame 0.
+        """
+        fig, ax, lines, fills, polygons = self.setup_blitted_figure()
+        if buffer is None:
+            buffer = deque(maxlen=self.buffer_size)
+        if frames is None:
+            frames = len(self.data)
+
+        def init():
+            return fills + lines
+
+        return FuncAnimation(fig, self.update_blitted, frames=frames, init_func=init,
+                             fargs=(lines, fills, polygons, buffer), interval=600, blit=True)
+
+    def render_blitted(self, output_file, fps=10, frames=None, buffer=None, lossless=False):
+        """
+        Render straight to ffmpeg, redrawing only the animated artists on top of a cached background.
+
+        `FuncAnimation.save` ignores blitting and redraws the whole figure for every frame; here the
+        static axes are drawn once and each frame restores that background, draws the buffered
+        polygons and lines, and pipes the raw RGBA canvas to the encoder.
+        Parameters are as for `create_blitted_animation`; `lossless` encodes as for open_encoder.
+        """
+        fig, ax, lines, fills, polygons = self.setup_blitted_figure()
+        if buffer is None:
+            buffer = deque(maxlen=self.buffer_size)
+        if frames is None:
+            frames = range(len(self.data))
+
+        canvas = fig.canvas
+        canvas.draw()
+        background = canvas.copy_from_bbox(fig.bbox)
+        width, height = canvas.get_width_height()
+
+        encoder = open_encoder(output_file, width, height, fps, lossless)
+        try:
+            for frame in frames:
+                canvas.restore_region(background)
+                for artist in self.update_blitted(frame, lines, fills, polygons, buffer):
+                    ax.draw_artist(artist)
+                encoder.stdin.write(canvas.buffer_rgba())
+        finally:
+            encoder.stdin.close()
+            encoder.wait()
+            plt.close(fig)
+
+        if encoder.returncode:
+            raise RuntimeError(f"ffmpeg failed with exit code {encoder.returncode} writing {output_file}")
+
+# Final encode of the serial path and of the joined segments, so both produce the same video
+VIDEO_ARGS = ['-vcodec', 'h264', '-pix_fmt', 'yuv420p']
+# Intra-only and lossless, segments keep exactly the RGBA frames that were rendered
+SEGMENT_ARGS = ['-vcodec', 'ffv1', '-pix_fmt', 'rgba']
+
+def open_encoder(output_file, width, height, fps, lossless=False):
+    """Start ffmpeg reading raw RGBA frames from stdin and encoding them as H.264, or losslessly as FFV1."""
+    return subprocess.Popen([
+        matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+        *(SEGMENT_ARGS if lossless else VIDEO_ARGS), output_file,
+    ], stdin=subprocess.PIPE)
+
+def render_segment(input_file, channels, buffer_size, start, end, segment_file, fps):
+    """
+    Render frames [start, end) into their own lossless video.
+
+    The history buffer is warmed up with the `buffer_size` frames before `start`, exactly what
+    the serial renderer would hold at that point, so the segment's frames match the serial ones.
+    """
+    radar_animation = RadarAnimation(input_file, channels, buffer_size)
+    buffer = deque(range(max(0, start - buffer_size), start), maxlen=buffer_size)
+    radar_animation.render_blitted(segment_file, fps=fps, frames=range(start, end), buffer=buffer, lossless=True)
+    return segment_file
+
+def concat_segments(segment_files, output_file, fps=10):
+    """
+    Join lossless segments and encode them once with the serial path's settings.
+
+    The encoder sees exactly the frames the serial renderer would feed it, so the result
+    is the same video, rather than lossy segments that each restart at a keyframe.
+    """
+    list_file = os.path.join(os.path.dirname(segment_files[0]), 'segments.txt')
+    with open(list_file, 'w') as file:
+        for segment_file in segment_files:
+            file.write(f"file '{os.path.abspath(segment_file)}'\n")
+    subprocess.run([
+        matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0', '-i', list_file, '-r', str(fps), *VIDEO_ARGS, output_file,
+    ], check=True)
+
+def render_parallel(input_file, output_file, channels, workers=None, fps=10, buffer_size=3):
+    """Split the frames across a process pool, render each segment losslessly, join them and encode the result."""
+    frames = len(load_samples(input_file, header=0))
+    if frames == 0:
+        print("... no frames found for video generation")
+        return
+    workers = max(1, min(workers or os.cpu_count() or 1, frames))
+    bounds = np.linspace(0, frames, workers + 1).astype(int)
+
+    segment_dir = tempfile.mkdtemp(prefix='radar_segments_', dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        segment_files = [os.path.join(segment_dir, f'segment_{i:03d}.mkv') for i in range(workers)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(render_segment, input_file, channels, buffer_size, start, end, segment_file, fps)
+                for start, end, segment_file in zip(bounds[:-1], bounds[1:], segment_files)
+            ]
+            for future in futures:
+                future.result()
+        concat_segments(segment_files, output_file, fps)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    print(f"... rendered {frames} frames in {workers} segments")
+
+def run_radar_animation(input_file, output_file, blit=True, workers=1, backend='matplotlib'):
+    """
+    Render the radar animation of a 16-column sample file to `output_file`.
+
+    Parameters:
+        blit (bool): Use the blitted renderer; False uses the original FuncAnimation path.
+        workers (int): Number of processes rendering segments in parallel, None for one per core.
+        backend (str): 'matplotlib', or 'raster' to draw with the NumPy/OpenCV renderer in processing.raster.
+    """
     print('run_radar_animation start')
     channels = [f'Col{i}' for i in range(16)]
-    radar_animation = RadarAnimation(input_file, channels)
-    anim = radar_animation.create_radar_animation()
-    anim.save(output_file, writer='ffmpeg', fps=10)
+    if backend == 'raster':
+        raster.render_radar_video(input_file, output_file, channels, fps=10)
+    elif not blit:
+        anim = RadarAnimation(input_file, channels).create_radar_animation()
+        anim.save(output_file, writer='ffmpeg', fps=10)
+    elif workers == 1:
+        RadarAnimation(input_file, channels).render_blitted(output_file, fps=10)
+    else:
+        render_parallel(input_file, output_file, channels, workers=workers, fps=10)
     print('run_radar_animation end')
-
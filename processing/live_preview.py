@@ -0,0 +1,208 @@
+import numpy as np
+import os
+import queue
+import threading
+import time
+from collections import deque
+from PyQt6 import QtGui, QtWidgets, sip
+from eeg.collect_filtered_data import OUTPUT_FILE, SAMPLING_FREQUENCY, TARGET_SAMPLES, start_collection
+from eeg.interpolate_data import OUTPUT_COLUMNS, interpolate_block
+from processing import raster
+from processing.quadrant_geometry import compute_geometry
+
+"""
+Live preview
+
+Shows the quadrant or radar view while the signal is still being recorded.
+The preview follows the ring buffer of a SensorSession started by
+collect_filtered_data, interpolates every new block from 4 to 16 columns as
+it arrives and draws the newest sample with the raster renderers.
+
+Frames are drawn on a fixed schedule of `fps` frames per second. A frame
+always shows the newest sample and frames are never queued, so the delay
+from a sample arriving to it being on screen stays within about one frame
+period plus the drawing time. When drawing falls behind, the slots that were
+missed are skipped instead of caught up. The delay of every frame is
+measured from the ring buffer write of its newest sample to the frame being
+handed to the window and reported as percentiles.
+"""
+LIVE_FPS = 25
+CALIBRATION_SECONDS = 1  # Samples used to fix the radar's radial axis
+RADAR_HISTORY = 3
+PERCENTILES = (50, 90, 99)
+
+class LivePreview:
+    def __init__(self, buffer, view='quadrant', fps=LIVE_FPS, sink=None, limits=None, size=raster.FRAME_SIZE):
+        """
+        Parameters:
+            buffer (RingBuffer): 4-column sample stream to follow, see SensorSession.buffer.
+            view (str): 'quadrant' or 'radar'.
+            fps (int): Frames drawn per second.
+            sink (callable): Called with every BGR frame, e.g. PreviewWindow.show_frame.
+            limits (tuple): Radial axis range of the radar, by default taken from the first CALIBRATION_SECONDS.
+            size (int): Frame width and height in pixels.
+        """
+        if view not in ('quadrant', 'radar'):
+            raise ValueError(f"Unknown view '{view}', expected 'quadrant' or 'radar'.")
+        self.reader = buffer.reader()
+        self.view = view
+        self.fps = fps
+        self.sink = sink
+        self.size = size
+
+        self.renderer = None
+        self.calibration = []
+        self.history = deque(maxlen=RADAR_HISTORY)
+        self.latest = None
+        self.arrival = None
+
+        self.frames = 0
+        self.skipped = 0
+        self.idle = 0
+        self.latencies = []
+        self.elapsed = 0.0
+
+        if view == 'quadrant':
+            self.renderer = raster.QuadrantRenderer(np.empty((0, OUTPUT_COLUMNS)), size=size)
+        elif limits is not None:
+            self._radar(limits)
+
+    def _radar(self, limits):
+        channels = [f'Col{i}' for i in range(OUTPUT_COLUMNS)]
+        self.renderer = raster.RadarRenderer(np.empty((0, OUTPUT_COLUMNS)), channels, RADAR_HISTORY, self.size, limits=limits)
+
+    def update(self):
+        """Interpolate the samples that arrived since the last call. Returns False if there were none."""
+        block = self.reader.read()
+        if not len(block):
+            return False
+        expanded = interpolate_block(block)
+        self.latest = expanded[-1]
+        self.arrival = self.reader.arrival
+
+        if self.renderer is None:
+            self.calibration.append(expanded)
+            if sum(len(rows) for rows in self.calibration) >= CALIBRATION_SECONDS * SAMPLING_FREQUENCY:
+                self._radar(raster.radial_limits(np.concatenate(self.calibration)))
+                self.calibration = []
+        return True
+
+    def render(self):
+        """Draw the newest sample and hand the frame to the sink."""
+        if self.view == 'radar':
+            self.history.append(self.latest)
+            frame = self.renderer.draw(self.history)
+        else:
+            frame = self.renderer.draw(compute_geometry(self.latest[None])[0], self.frames + 1)
+        if self.sink:
+            self.sink(frame)
+        self.frames += 1
+        self.latencies.append(time.perf_counter() - self.arrival)
+        return frame
+
+    def run(self, stop, duration=None):
+        """Draw frames on the `fps` schedule until `stop` is set or `duration` seconds have passed."""
+        period = 1 / self.fps
+        start = time.perf_counter()
+        next_frame = start
+        while not stop.is_set():
+            now = time.perf_counter()
+            if duration is not None and now - start >= duration:
+                break
+            if now < next_frame:
+                stop.wait(next_frame - now)
+                continue
+
+            # Slots missed while the last frame was drawn are dropped, not caught up
+            missed = int((now - next_frame) / period)
+            self.skipped += missed
+            next_frame += (missed + 1) * period
+
+            if self.update() and self.renderer is not None:
+                self.render()
+            else:
+                self.idle += 1
+        self.elapsed = time.perf_counter() - start
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        stats = {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'idle': self.idle,
+            'fps': self.frames / self.elapsed if self.elapsed else 0.0,
+            'samples_skipped': self.reader.skipped,
+        }
+        for percentile in PERCENTILES:
+            stats[f'latency_p{percentile}'] = float(np.percentile(latencies, percentile)) if len(latencies) else 0.0
+        stats['latency_max'] = float(latencies.max()) if len(latencies) else 0.0
+        return stats
+
+    def print_stats(self):
+        stats = self.stats()
+        print('... {0} frames at {1:.1f} fps, {2} skipped, {3} idle'.format(
+            stats['frames'], stats['fps'], stats['skipped'], stats['idle']))
+        print('... latency {0}, max: {1:.1f} ms'.format(
+            ', '.join(f"p{p}: {stats[f'latency_p{p}']:.1f} ms" for p in PERCENTILES), stats['latency_max']))
+
+class PreviewWindow(QtWidgets.QLabel):
+    def __init__(self, stop, title="Live Preview", size=raster.FRAME_SIZE):
+        super().__init__()
+        self.stop = stop
+        self.setWindowTitle(title)
+        self.resize(size, size)
+
+    def show_frame(self, frame):
+        height, width, layers = frame.shape
+        image = QtGui.QImage(frame.data, width, height, frame.strides[0], QtGui.QImage.Format.Format_BGR888)
+        self.setPixmap(QtGui.QPixmap.fromImage(image))
+        QtWidgets.QApplication.processEvents()
+
+    def closeEvent(self, event):
+        self.stop.set()
+        super().closeEvent(event)
+
+def run_live_preview(view='quadrant', output_file=OUTPUT_FILE, raw_output_file=None, scanner=None,
+                     target_samples=TARGET_SAMPLES, fps=LIVE_FPS, headless=False, sensor_count=None):
+    """
+    Record like collect_filtered_data and show the first sensor live while it records.
+
+    Returns the number of filtered samples captured, as collect_filtered_data does. A QApplication
+    created for the preview is deleted again before returning.
+    """
+    print('run_live_preview start')
+    sessions = queue.Queue()
+    collection = start_collection(output_file, raw_output_file, scanner, target_samples, sensor_count, on_start=sessions.put)
+    stop = threading.Event()
+    collection.add_done_callback(lambda future: stop.set())
+
+    session = None
+    while session is None and not collection.done():
+        try:
+            session = sessions.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    if session is not None:
+        if headless:
+            os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QtWidgets.QApplication.instance()
+        owned = app is None
+        app = app or QtWidgets.QApplication([])
+        window = PreviewWindow(stop, f"Live Preview - {session.name}")
+        window.show()
+
+        preview = LivePreview(session.buffer, view, fps, sink=window.show_frame)
+        preview.run(stop)
+        preview.print_stats()
+        window.close()
+        if owned:
+            # Pipeline workers forked after the recording would inherit the application and its
+            # display connection, and create_quadrant_animation would pick it up instead of its own
+            sip.delete(window)
+            app.quit()
+            sip.delete(app)
+
+    samples = collection.result()
+    print('run_live_preview end')
+    return samples
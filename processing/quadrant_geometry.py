@@ -0,0 +1,62 @@
+import numpy as np
+
+"""
+Quadrant geometry
+
+Precomputes the x/y coordinates of every line of the quadrant visualization
+as a (frames x quadrants x lines x points x 2) array in one vectorized pass.
+
+Line i of a quadrant spans the angles [i * pi/2, (i + 1) * pi/2) with one
+point per value plus i + 1 repetitions of the first value, and is closed back
+to its first point. Lines therefore have 5, 6, 7 and 8 points; shorter lines
+are padded by repeating their closing point, which doesn't change the drawn
+polyline but keeps the array rectangular.
+
+Long recordings are computed lazily in chunks of `chunk_frames` frames.
+"""
+QUADRANTS = 4
+LINES = 4
+CHUNK_FRAMES = 4096
+
+def line_layout(values_per_quadrant, lines=LINES):
+    """Return the (lines x points) angles and indices into the quadrant values of every point."""
+    points = values_per_quadrant + lines
+    angles = np.empty((lines, points))
+    indices = np.zeros((lines, points), dtype=np.intp)
+    for i in range(lines):
+        count = values_per_quadrant + i
+        line_angles = np.linspace(i * (np.pi / 2), (i + 1) * (np.pi / 2), count, endpoint=False)
+        angles[i, :count] = line_angles
+        angles[i, count:] = line_angles[0]
+        indices[i, :values_per_quadrant] = np.arange(values_per_quadrant)
+    return angles, indices
+
+def compute_geometry(data, quadrants=QUADRANTS, lines=LINES):
+    """Coordinates of every line for every frame of `data` (frames x channels)."""
+    data = np.asarray(data, dtype=np.float64)
+    values = data.reshape(len(data), quadrants, -1)
+    angles, indices = line_layout(values.shape[2], lines)
+
+    radii = values[:, :, indices]
+    geometry = np.empty(radii.shape + (2,))
+    np.multiply(radii, np.cos(angles), out=geometry[..., 0])
+    np.multiply(radii, np.sin(angles), out=geometry[..., 1])
+    return geometry
+
+class QuadrantGeometry:
+    def __init__(self, data, chunk_frames=CHUNK_FRAMES):
+        self.data = data
+        self.chunk_frames = chunk_frames or len(data) or 1
+        self._chunk_start = None
+        self._chunk = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def frame(self, index):
+        """Return the (quadrants x lines x points x 2) coordinates of one frame."""
+        start = index - index % self.chunk_frames
+        if start != self._chunk_start:
+            self._chunk = compute_geometry(self.data[start:start + self.chunk_frames])
+            self._chunk_start = start
+        return self._chunk[index - start]
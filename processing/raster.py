@@ -0,0 +1,238 @@
+import cv2
+import numpy as np
+from collections import deque
+from eeg.sample_store import load_samples
+from processing.quadrant_geometry import QuadrantGeometry
+
+"""
+Raster renderer backend
+
+Draws the radar and quadrant visualizations straight into preallocated NumPy
+frame buffers, without matplotlib or Qt, so they render with no display and
+without the seconds of GUI start-up. Lines, polygons and circles are
+rasterized with OpenCV's anti-aliased primitives at sub-pixel precision;
+translucent shapes are drawn onto a reusable overlay buffer and blended back
+into the frame within their bounding box. Static layers (grid, axes, labels)
+are drawn once and restored into the frame buffer at the start of every frame.
+
+Frames are handed to the encoder as they are produced. The generators yield
+the same buffer every time, so consumers must use a frame before asking for
+the next one.
+"""
+FPS = 10
+FRAME_SIZE = 800
+SHIFT = 4  # Sub-pixel bits of the fixed-point coordinates passed to OpenCV
+SCALE = 1 << SHIFT
+
+# matplotlib's default colour cycle, as RGB
+TAB_COLORS = [(31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40)]
+
+class Canvas:
+    def __init__(self, width, height, view, background=(0, 0, 0)):
+        """
+        Parameters:
+            width, height (int): Frame size in pixels.
+            view (tuple): Visible (xmin, xmax, ymin, ymax) in data coordinates, y pointing up.
+            background (tuple): RGB background colour.
+        """
+        self.width = width
+        self.height = height
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.frame[:] = background[::-1]
+        self.background = self.frame.copy()
+        self._overlay = self.frame.copy()
+
+        xmin, xmax, ymin, ymax = view
+        self._scale = np.array([width / (xmax - xmin), -height / (ymax - ymin)])
+        self._offset = np.array([-xmin * self._scale[0], height - ymin * self._scale[1]])
+
+    def to_pixels(self, points):
+        """Map (n x 2) data coordinates to OpenCV fixed-point pixel coordinates."""
+        pixels = np.asarray(points, dtype=np.float64) * self._scale + self._offset
+        return np.round(pixels * SCALE).astype(np.int32)
+
+    def clear(self):
+        np.copyto(self.frame, self.background)
+
+    def freeze_background(self):
+        """Keep what has been drawn so far as the static layer restored by `clear`."""
+        np.copyto(self.background, self.frame)
+
+    def _color(self, color):
+        return tuple(int(c) for c in color[::-1])
+
+    def _bounds(self, pixels, margin):
+        x0, y0 = np.maximum(pixels.min(axis=0) // SCALE - margin, 0)
+        x1, y1 = np.minimum(pixels.max(axis=0) // SCALE + margin + 1, [self.width, self.height])
+        return slice(y0, max(y0, y1)), slice(x0, max(x0, x1))
+
+    def _translucent(self, draw, alpha, pixels, margin):
+        # Draw onto a copy of the affected region and blend the copy back with `alpha`
+        region = self._bounds(pixels, margin)
+        np.copyto(self._overlay[region], self.frame[region])
+        draw(self._overlay)
+        cv2.addWeighted(self._overlay[region], alpha, self.frame[region], 1 - alpha, 0, dst=self.frame[region])
+
+    def polyline(self, points, color, width=1, alpha=1.0, closed=False):
+        pixels = self.to_pixels(points)
+        draw = lambda image: cv2.polylines(image, [pixels], closed, self._color(color), width, cv2.LINE_AA, SHIFT)
+        if alpha >= 1:
+            draw(self.frame)
+        else:
+            self._translucent(draw, alpha, pixels, width + 1)
+
+    def polygon(self, points, color, alpha=1.0):
+        pixels = self.to_pixels(points)
+        draw = lambda image: cv2.fillPoly(image, [pixels], self._color(color), cv2.LINE_AA, SHIFT)
+        if alpha >= 1:
+            draw(self.frame)
+        else:
+            self._translucent(draw, alpha, pixels, 1)
+
+    def circle(self, center, radius, color, width=1, filled=False, pixel_radius=False):
+        """Circle around a data coordinate; `radius` is in data units unless `pixel_radius` is set."""
+        pixel = self.to_pixels([center])[0]
+        radius = radius if pixel_radius else radius * abs(self._scale[0])
+        thickness = cv2.FILLED if filled else width
+        cv2.circle(self.frame, tuple(int(p) for p in pixel), int(round(radius * SCALE)), self._color(color), thickness, cv2.LINE_AA, SHIFT)
+
+    def grid(self, xs, ys, color, alpha=1.0, width=1):
+        """Vertical lines at data x positions `xs` and horizontal lines at `ys`."""
+        xmin, ymax = (np.array([0, 0]) - self._offset) / self._scale
+        xmax, ymin = (np.array([self.width, self.height]) - self._offset) / self._scale
+        for x in xs:
+            self.polyline([(x, ymin), (x, ymax)], color, width, alpha)
+        for y in ys:
+            self.polyline([(xmin, y), (xmax, y)], color, width, alpha)
+
+    def text(self, text, position, color, scale=0.45, center=True):
+        pixel = self.to_pixels([position])[0] // SCALE
+        if center:
+            (w, h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+            pixel = pixel + np.array([-w // 2, h // 2])
+        cv2.putText(self.frame, text, tuple(int(p) for p in pixel), cv2.FONT_HERSHEY_SIMPLEX, scale, self._color(color), 1, cv2.LINE_AA)
+
+def radial_limits(data):
+    """Radial axis range covering the whole recording plus a 5 % margin."""
+    rmin, rmax = (float(np.min(data)), float(np.max(data))) if len(data) else (0.0, 1.0)
+    margin = 0.05 * (rmax - rmin) or 0.05
+    return rmin - margin, rmax + margin
+
+class RadarRenderer:
+    def __init__(self, data, channels, buffer_size=3, size=FRAME_SIZE, limits=None):
+        """`limits` fixes the (min, max) of the radial axis, by default the range of `data`."""
+        self.data = data
+        self.channels = channels
+        self.buffer_size = buffer_size
+        self.rmin, self.rmax = limits or radial_limits(data)
+
+        # Normalized radius 1 is the outer circle, the margin leaves room for the labels
+        self.canvas = Canvas(size, size, (-1.25, 1.25, -1.25, 1.25), background=(255, 255, 255))
+        self.theta = np.linspace(0, 2 * np.pi, len(channels) + 1)
+        self.unit = np.column_stack([np.cos(self.theta), np.sin(self.theta)])
+        self.points = np.empty((len(channels) + 1, 2))
+        self.draw_axes()
+
+    def radius(self, values):
+        return (values - self.rmin) / (self.rmax - self.rmin)
+
+    def draw_axes(self):
+        canvas = self.canvas
+        circle = np.column_stack([np.cos(np.linspace(0, 2 * np.pi, 181)), np.sin(np.linspace(0, 2 * np.pi, 181))])
+        for tick in np.linspace(self.rmin, self.rmax, 6)[1:-1]:
+            canvas.polyline(circle * self.radius(tick), (176, 176, 176), alpha=0.8, closed=True)
+            canvas.text(f'{tick:.2f}', self.unit[1] * self.radius(tick) * 0.98 + (0.04, 0.02), (0, 0, 0), scale=0.35)
+        for (x, y), channel in zip(self.unit[:-1], self.channels):
+            canvas.polyline([(0, 0), (x, y)], (176, 176, 176), alpha=0.8)
+            canvas.text(channel, (x * 1.12, y * 1.12), (0, 0, 0))
+        canvas.polyline(circle, (0, 0, 0), closed=True)
+        canvas.freeze_background()
+
+    def frames(self, frames=None, buffer=None):
+        """Yield the canvas frame for every frame index, holding the last `buffer_size` frames like the matplotlib renderer."""
+        if buffer is None:
+            buffer = deque(maxlen=self.buffer_size)
+        if frames is None:
+            frames = range(len(self.data))
+
+        for frame in frames:
+            buffer.append(frame)
+            yield self.draw([self.data[index] for index in buffer])
+
+    def draw(self, rows):
+        """Draw the radar of `rows`, oldest first, and return the canvas frame."""
+        self.canvas.clear()
+        for i, values in enumerate(rows):
+            self.points[:-1] = self.unit[:-1] * self.radius(values)[:, None]
+            self.points[-1] = self.points[0]
+            self.canvas.polygon(self.points, TAB_COLORS[i], alpha=0.2 * (i + 1))
+        for i, values in enumerate(rows):
+            self.points[:-1] = self.unit[:-1] * self.radius(values)[:, None]
+            self.points[-1] = self.points[0]
+            self.canvas.polyline(self.points, TAB_COLORS[i], width=2)
+            for point in self.points[:-1]:
+                self.canvas.circle(point, 4, TAB_COLORS[i], filled=True, pixel_radius=True)
+        return self.canvas.frame
+
+class QuadrantRenderer:
+    QUADRANT_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 0, 255)]
+
+    def __init__(self, data, size=FRAME_SIZE, view=0.1):
+        self.data = data
+        self.geometry = QuadrantGeometry(data)
+        self.canvas = Canvas(size, size, (-view, view, -view, view), background=(0, 0, 0))
+        self.draw_axes(view)
+
+    def draw_axes(self, view):
+        canvas = self.canvas
+        minor = np.arange(-view, view + 1e-9, view / 10)
+        major = np.arange(-view, view + 1e-9, view / 2)
+        canvas.grid(minor, minor, (255, 255, 255), alpha=0.12)
+        canvas.grid(major, major, (255, 255, 255), alpha=0.5)
+        theta = np.linspace(0, 2 * np.pi, 500)
+        canvas.polyline(np.column_stack([np.cos(theta), np.sin(theta)]), (255, 255, 255), width=2)
+        canvas.text('Quadrants', (0, view * 0.94), (200, 200, 200), scale=0.6)
+        canvas.freeze_background()
+
+    def frames(self, frames=None):
+        if frames is None:
+            frames = range(len(self.data))
+
+        for index in frames:
+            yield self.draw(self.geometry.frame(index), index + 1)
+
+    def draw(self, geometry, lines):
+        """Draw the first `lines` lines of every quadrant of one frame's geometry and return the canvas frame."""
+        self.canvas.clear()
+        for quadrant, color in enumerate(self.QUADRANT_COLORS):
+            for i in range(min(lines, geometry.shape[1])):
+                self.canvas.polyline(geometry[quadrant, i], color, width=2)
+        return self.canvas.frame
+
+def write_video(frames, output_file, fps=FPS):
+    """Stream BGR frames into an MP4 file as they are produced."""
+    video = None
+    count = 0
+    for frame in frames:
+        if video is None:
+            height, width, layers = frame.shape
+            video = cv2.VideoWriter(output_file, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        video.write(frame)
+        count += 1
+
+    if video is None:
+        print("... no frames found for video generation")
+        return 0
+    video.release()
+    print(f"... video saved as {output_file}")
+    return count
+
+def render_radar_video(input_file, output_file, channels=None, buffer_size=3, fps=FPS):
+    data = load_samples(input_file, header=0)
+    channels = channels or [f'Col{i}' for i in range(data.shape[1])]
+    renderer = RadarRenderer(data[:, :len(channels)], channels, buffer_size)
+    return write_video(renderer.frames(), output_file, fps)
+
+def render_quadrant_video(input_file, output_file, fps=FPS, view=0.1):
+    renderer = QuadrantRenderer(load_samples(input_file, header=0), view=view)
+    return write_video(renderer.frames(), output_file, fps)
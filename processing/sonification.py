@@ -0,0 +1,221 @@
+import collections
+import concurrent.futures
+import os
+import struct
+import numpy as np
+from eeg.sample_store import iter_samples
+
+"""
+Sonification core
+
+Turns EEG channels into note events with whole-array NumPy operations and
+writes them as a Standard MIDI File without going through MIDIUtil.
+
+A `Score` holds one row per note (start and duration in beats, pitch,
+velocity) plus the tempo map. `write_midi` serializes it the way
+MIDIFile(1) does: a format 1 file at 960 ticks per quarter note with a tempo
+track and one note track, note-offs sorted before note-ons on the same tick,
+and overlapping notes of the same pitch cut off where the next one starts.
+Tempo events that don't change the tempo are dropped.
+
+`compile_session` covers a whole recording instead of its tail: fixed windows
+are streamed from disk, compiled independently and stitched into one timeline.
+"""
+TICKS_PER_QUARTER = 960
+MIDI_RANGE = 128
+CHANNEL = 0
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+def normalize(values, min_val=0, max_val=127):
+    """Scale `values` linearly onto the integers min_val..max_val, truncating like int()."""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    data_min, data_max = values.min(), values.max()
+    if data_max == data_min:
+        return np.full(len(values), int((min_val + max_val) / 2), dtype=np.int64)
+    return ((values - data_min) / (data_max - data_min) * (max_val - min_val) + min_val).astype(np.int64)
+
+def shift_high_pitches(pitches, threshold, octaves=4):
+    """Shift pitches above `threshold` down by `octaves` octaves."""
+    pitches = np.asarray(pitches)
+    return np.where(pitches > threshold, pitches - 12 * octaves, pitches)
+
+def scale_lookup(scale):
+    """Table mapping every MIDI pitch to the nearest note of `scale`, the lower one on ties."""
+    scale = np.sort(np.asarray(scale))
+    distance = np.abs(np.arange(MIDI_RANGE)[:, None] - scale[None, :])
+    return scale[np.argmin(distance, axis=1)]
+
+def collapse_tempos(ticks, tempos):
+    """Keep the last tempo set on each tick, then only the ones that change the tempo."""
+    ticks = np.asarray(ticks)
+    tempos = np.asarray(tempos)
+    last = np.append(ticks[1:] != ticks[:-1], True)
+    ticks, tempos = ticks[last], tempos[last]
+    changed = np.insert(tempos[1:] != tempos[:-1], 0, True)
+    return ticks[changed], tempos[changed]
+
+class Score:
+    def __init__(self, starts, durations, pitches, velocities, tempo_times=(0,), tempos=(120,)):
+        """
+        Parameters:
+            starts, durations (array): Note start times and lengths in beats.
+            pitches, velocities (array): MIDI note numbers and velocities (0-127).
+            tempo_times (array): Beats at which the tempos in `tempos` (bpm) take effect.
+        """
+        self.starts = np.asarray(starts)
+        self.durations = np.asarray(durations)
+        self.pitches = np.asarray(pitches, dtype=np.int64)
+        self.velocities = np.asarray(velocities, dtype=np.int64)
+        self.tempo_times = np.asarray(tempo_times)
+        self.tempos = np.asarray(tempos, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def select(self, mask):
+        """Score with only the notes where `mask` is set and the same tempo map."""
+        return Score(self.starts[mask], self.durations[mask], self.pitches[mask], self.velocities[mask], self.tempo_times, self.tempos)
+
+def concatenate_scores(scores, offsets):
+    """Join scores into one timeline, shifting each score's notes and tempo changes by its offset in beats."""
+    return Score(
+        np.concatenate([score.starts + offset for score, offset in zip(scores, offsets)]),
+        np.concatenate([score.durations for score in scores]),
+        np.concatenate([score.pitches for score in scores]),
+        np.concatenate([score.velocities for score in scores]),
+        np.concatenate([score.tempo_times + offset for score, offset in zip(scores, offsets)]),
+        np.concatenate([score.tempos for score in scores]),
+    )
+
+def compile_session(input_file, compile_window, window_size, beats_per_sample, workers=None):
+    """
+    Sonify a whole recording window by window and stitch the windows into one score.
+
+    The recording is streamed from disk `window_size` samples at a time and every window is
+    compiled on its own by `compile_window(block) -> Score` (a module-level function), in a
+    process pool when there is more than one window. Window k starts where window k - 1
+    ends, `beats_per_sample` beats per sample later.
+    """
+    windows = iter_samples(input_file, window_size, header=0)
+    workers = workers or os.cpu_count() or 1
+
+    scores, lengths = [], []
+    if workers == 1:
+        for block in windows:
+            scores.append(compile_window(block))
+            lengths.append(len(block))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of windows in flight, so the recording is never fully in memory
+            pending = collections.deque()
+            for block in windows:
+                if len(pending) >= 2 * workers:
+                    scores.append(pending.popleft().result())
+                pending.append(executor.submit(compile_window, np.array(block)))
+                lengths.append(len(block))
+            scores.extend(future.result() for future in pending)
+
+    if not scores:
+        return Score([], [], [], [])
+    offsets = beats_per_sample * np.concatenate([[0], np.cumsum(lengths[:-1])])
+    return concatenate_scores(scores, offsets)
+
+def to_ticks(beats):
+    return (np.asarray(beats) * TICKS_PER_QUARTER).astype(np.int64)
+
+def _var_length(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
+
+def _track(events):
+    data = bytearray()
+    previous = 0
+    for tick, payload in events:
+        data += _var_length(tick - previous)
+        data += payload
+        previous = tick
+    data += b'\x00\xff\x2f\x00'
+    return b'MTrk' + struct.pack('>L', len(data)) + data
+
+def tempo_map(score):
+    """Ticks and microseconds per quarter note of the tempo changes of `score`."""
+    ticks, tempos = collapse_tempos(to_ticks(score.tempo_times), score.tempos)
+    return ticks, (60000000 / tempos).astype(np.int64)
+
+def tempo_events(score):
+    ticks, microseconds = tempo_map(score)
+    return [(tick, b'\xff\x51\x03' + struct.pack('>L', value)[1:]) for tick, value in zip(ticks.tolist(), microseconds.tolist())]
+
+def note_table(score):
+    """
+    Note-on and note-off events of `score` in file order as an (events x 4) array
+    with the columns tick, on (1) or off (0), pitch and velocity.
+    """
+    count = len(score)
+    on = to_ticks(score.starts)
+    off = on + np.maximum(to_ticks(score.durations), 0)
+    pitches = np.clip(score.pitches, 0, 127)
+    velocities = np.clip(score.velocities, 0, 127)
+
+    # Events as columns (tick, kind, insertion order, pitch, velocity); note-offs sort first on a tick
+    ticks = np.concatenate([on, off])
+    kinds = np.repeat([1, 0], count)
+    order = np.tile(np.arange(count), 2)
+    keys = np.stack([ticks, kinds, order, np.tile(pitches, 2), np.tile(velocities, 2)], axis=1)
+
+    # Drop repeated events on one tick and pitch, like MIDIUtil's removeDuplicates
+    _, first = np.unique(keys[:, [0, 1, 3]], axis=0, return_index=True)
+    keys = keys[np.sort(first)]
+    keys = keys[np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))]
+
+    # A note-off reached while a later note of the same pitch is still sounding ends
+    # at the start of the most recent one, so the notes never interleave
+    sounding = {}
+    for event in keys:
+        tick, kind, _, pitch, _ = event.tolist()
+        stack = sounding.setdefault(pitch, [])
+        if kind:
+            stack.append(tick)
+        elif len(stack) > 1:
+            event[0] = stack.pop()
+        elif stack:
+            stack.pop()
+    keys = keys[np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))]
+    return keys[:, [0, 1, 3, 4]]
+
+def note_events(score):
+    """Note-on and note-off events of `score` in file order as (tick, bytes) pairs."""
+    return [(tick, struct.pack('>BBB', (NOTE_ON if kind else NOTE_OFF) | CHANNEL, pitch, velocity)) for tick, kind, pitch, velocity in note_table(score).tolist()]
+
+def ticks_to_seconds(ticks, tempo_ticks, microseconds):
+    """Convert ticks to seconds under the tempo map (tempo_ticks, microseconds per quarter note)."""
+    ticks = np.asarray(ticks)
+    seconds_per_tick = np.asarray(microseconds) / 1e6 / TICKS_PER_QUARTER
+    # Time at which every tempo change happens; the first tempo also covers the ticks before it
+    tempo_ticks = np.asarray(tempo_ticks).copy()
+    tempo_ticks[0] = 0
+    offsets = np.concatenate([[0], np.cumsum(np.diff(tempo_ticks) * seconds_per_tick[:-1])])
+    segment = np.searchsorted(tempo_ticks, ticks, side='right') - 1
+    return offsets[segment] + (ticks - tempo_ticks[segment]) * seconds_per_tick[segment]
+
+def timed_notes(score):
+    """Note events of `score` with their times in seconds: (seconds, on, pitch, velocity) arrays."""
+    table = note_table(score)
+    seconds = ticks_to_seconds(table[:, 0], *tempo_map(score))
+    return seconds, table[:, 1], table[:, 2], table[:, 3]
+
+def midi_bytes(score):
+    header = b'MThd' + struct.pack('>LHHH', 6, 1, 2, TICKS_PER_QUARTER)
+    return header + _track(tempo_events(score)) + _track(note_events(score))
+
+def write_midi(score, output_file):
+    with open(output_file, 'wb') as file:
+        file.write(midi_bytes(score))
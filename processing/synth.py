@@ -0,0 +1,120 @@
+import subprocess
+import numpy as np
+from pydub import AudioSegment
+from processing.sonification import timed_notes
+
+"""
+Built-in synthesizer
+
+Renders a sonification `Score` to 16-bit PCM without a SoundFont or an
+external synthesizer. Every note is an additive voice (a sine and a few
+harmonics) shaped by an ADSR envelope and scaled by its velocity.
+
+Audio is produced in blocks of `block_size` samples. Note events are placed
+on their exact sample, voices are mixed only over the blocks they sound in,
+and each block is written to the MP3 encoder's stdin as soon as it is ready,
+so memory use doesn't grow with the length of the piece and no WAV file is
+written.
+"""
+SAMPLE_RATE = 44100
+BLOCK_SIZE = 4096
+HARMONICS = [1.0, 0.5, 0.25, 0.125]
+
+# Envelope times in seconds and the sustain level relative to the peak
+ATTACK = 0.01
+DECAY = 0.15
+SUSTAIN = 0.6
+RELEASE = 0.3
+
+MASTER_GAIN = 0.8
+
+def note_frequency(pitch):
+    return 440.0 * 2 ** ((pitch - 69) / 12)
+
+class Voice:
+    def __init__(self, pitch, velocity, start):
+        self.pitch = pitch
+        self.gain = velocity / 127
+        self.frequencies = note_frequency(pitch) * np.arange(1, len(HARMONICS) + 1)
+        self.start = start
+        self.stop = None
+
+    def envelope(self, t, sample_rate):
+        """Envelope at times `t` (seconds since the note started)."""
+        level = np.interp(t, [0, ATTACK, ATTACK + DECAY], [0, 1, SUSTAIN])
+        if self.stop is None:
+            return level
+        released = (self.stop - self.start) / sample_rate
+        release_level = np.interp(released, [0, ATTACK, ATTACK + DECAY], [0, 1, SUSTAIN])
+        fade = release_level * np.clip(1 - (t - released) / RELEASE, 0, 1)
+        return np.where(t < released, level, fade)
+
+    def finished(self, sample, sample_rate):
+        return self.stop is not None and sample >= self.stop + RELEASE * sample_rate
+
+    def render(self, first, count, sample_rate):
+        """Signal of this voice for samples [first, first + count)."""
+        t = (np.arange(first, first + count) - self.start) / sample_rate
+        # Harmonics with a frequency above Nyquist would alias, leave them out
+        audible = self.frequencies < sample_rate / 2
+        phases = 2 * np.pi * np.outer(t, self.frequencies[audible])
+        signal = np.sin(phases) @ np.asarray(HARMONICS)[audible]
+        return self.gain * self.envelope(t, sample_rate) * signal / sum(HARMONICS)
+
+class Synthesizer:
+    def __init__(self, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+
+    def blocks(self, score):
+        """Yield the rendered piece as int16 blocks of at most `block_size` mono samples."""
+        seconds, on, pitches, velocities = timed_notes(score)
+        samples = np.round(seconds * self.sample_rate).astype(np.int64).tolist()
+        on, pitches, velocities = on.tolist(), pitches.tolist(), velocities.tolist()
+        end = (samples[-1] if samples else 0) + int(RELEASE * self.sample_rate)
+
+        voices = []
+        event = 0
+        for first in range(0, end, self.block_size):
+            count = min(self.block_size, end - first)
+            last = first + count
+
+            # Start and release every voice whose event falls within this block
+            while event < len(samples) and samples[event] < last:
+                if on[event]:
+                    voices.append(Voice(pitches[event], velocities[event], samples[event]))
+                else:
+                    for voice in voices:
+                        if voice.pitch == pitches[event] and voice.stop is None:
+                            voice.stop = samples[event]
+                event += 1
+
+            mix = np.zeros(count)
+            for voice in voices:
+                mix += voice.render(first, count, self.sample_rate)
+            voices = [voice for voice in voices if not voice.finished(last, self.sample_rate)]
+
+            # Soft clip, so chords saturate smoothly instead of wrapping around
+            yield (np.tanh(MASTER_GAIN * mix) * 32767).astype(np.int16)
+
+def open_mp3_encoder(output_file, sample_rate=SAMPLE_RATE):
+    """Start ffmpeg reading mono 16-bit PCM from stdin and encoding it as MP3."""
+    return subprocess.Popen([
+        AudioSegment.converter, '-y', '-loglevel', 'error',
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', '-',
+        '-f', 'mp3', output_file,
+    ], stdin=subprocess.PIPE)
+
+def render_mp3(score, output_file, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+    """Synthesize `score` and stream it into an MP3 file block by block."""
+    encoder = open_mp3_encoder(output_file, sample_rate)
+    try:
+        for block in Synthesizer(sample_rate, block_size).blocks(score):
+            encoder.stdin.write(block.tobytes())
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+
+    if encoder.returncode:
+        raise RuntimeError(f"ffmpeg failed with exit code {encoder.returncode} writing {output_file}")
+    print(f"... MP3 saved to: {output_file}")
@@ -0,0 +1,100 @@
+import email.parser
+import email.policy
+import http.server
+import json
+import threading
+
+"""
+Stand-in artifact server
+
+Local HTTP server accepting the multipart uploads of upload_artifacts, for
+exercising the uploader without the real API. Received files are kept in
+memory by URL path and file name. `fail_first` makes the first requests
+answer 503 so retries can be observed, and `delay` slows every response.
+
+    with StandInServer(fail_first=2) as server:
+        upload_artifacts(uuid, api_url=server.url)
+        print(server.received)
+"""
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server.stand_in
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        with server.lock:
+            server.requests += 1
+            failing = server.requests <= server.fail_first
+            server.connections.add(self.client_address)
+        if server.delay:
+            server.stop.wait(server.delay)
+        if failing:
+            self._reply(503, {"error": "stand-in server failing on purpose"})
+            return
+
+        headers = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8')
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(headers + body)
+        files = []
+        for part in message.iter_parts():
+            filename = part.get_filename()
+            if filename:
+                with server.lock:
+                    server.received[(self.path, filename)] = part.get_payload(decode=True)
+                files.append(filename)
+        self._reply(200, {"status": "ok", "files": files})
+
+class StandInServer:
+    def __init__(self, host='127.0.0.1', port=0, fail_first=0, delay=0.0):
+        self.fail_first = fail_first
+        self.delay = delay
+        self.requests = 0
+        self.connections = set()
+        self.received = {}
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+
+        self._server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/artifacts/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stand-in-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    with StandInServer() as server:
+        print(f"... stand-in server listening on {server.url}")
+        server.stop.wait()
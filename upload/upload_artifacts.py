@@ -1,29 +1,256 @@
-import requests
+import concurrent.futures
+import mimetypes
 import os
+import queue
+import threading
+import time
+import uuid as uuid_lib
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+Artifact uploader
+
+Files are posted as multipart/form-data over one pooled `requests.Session`,
+so connections are reused across files, several at a time from a thread
+pool. Request bodies are streamed from disk: `MultipartFile` is a file-like
+object with a known length that produces the multipart framing around the
+file's bytes as they are read, so videos are never buffered in memory.
+
+Connection errors, timeouts and 429 / 5xx responses are retried with
+exponential backoff. Every upload records its size, attempts, latency and
+throughput.
 
+`UploadQueue` uploads artifacts as they are produced: a background thread
+drains the paths published to it, typically by the pipeline's
+`on_stage_done`, and starts uploading each one straight away, so only the
+current session's files are sent and the first ones arrive while the
+slower stages are still running.
+"""
 API_URL = 'https://digitalbrain.techschool.lu/artifacts/'
+ALLOWED_EXTENSIONS = {".mp4", ".mid", ".mp3"}
+
+WORKERS = 4
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = (5, 120)  # Connect and read timeouts in seconds
+READ_SIZE = 1 << 16
+
+class MultipartFile:
+    """Streaming multipart/form-data body with a single file field."""
+    def __init__(self, path, field='file', boundary=None):
+        self.path = path
+        self.boundary = boundary or uuid_lib.uuid4().hex
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self._head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self._size = os.path.getsize(path)
+        self._parts = None
+        self._buffer = b''
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def _chunks(self):
+        yield self._head
+        with open(self.path, 'rb') as file:
+            for chunk in iter(lambda: file.read(READ_SIZE), b''):
+                yield chunk
+        yield self._tail
+
+    def read(self, size=-1):
+        if self._parts is None:
+            self._parts = self._chunks()
+        # Hand out at most one underlying chunk per call, so memory stays bounded by READ_SIZE
+        if not self._buffer:
+            self._buffer = next(self._parts, b'')
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+class UploadResult:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.status_code = None
+        self.response = None
+        self.error = None
+        self.attempts = 0
+        self.latency = 0.0  # Duration of the last attempt
+        self.elapsed = 0.0  # Including failed attempts and backoff
+
+    @property
+    def ok(self):
+        return self.status_code is not None and self.status_code < 400
+
+    @property
+    def throughput(self):
+        return self.size / self.latency if self.latency else 0.0
+
+def _parse_response(response):
+    # Check response content before parsing JSON
+    try:
+        return response.json()
+    except requests.exceptions.JSONDecodeError:
+        return {"error": "Invalid or empty response from server", "status_code": response.status_code}
+
+class Uploader:
+    def __init__(self, api_url=API_URL, workers=WORKERS, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        """
+        Parameters:
+            api_url (str): Base URL, the session's UUID is appended to it.
+            workers (int): Number of files uploaded at the same time.
+            retries (int): Retries per file after the first attempt.
+            backoff (float): Delay before the first retry in seconds, doubled for every further one.
+            timeout (tuple): Connect and read timeouts in seconds.
+        """
+        self.api_url = api_url
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-def upload_artifacts(uuid):
+    def _retryable(self, status_code):
+        return status_code == 429 or status_code >= 500
+
+    def upload_file(self, uuid, path):
+        """Post one file, retrying transient failures. Returns its UploadResult."""
+        result = UploadResult(path, os.path.getsize(path))
+        url = f"{self.api_url}{uuid}"
+        start = time.perf_counter()
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            result.attempts += 1
+            body = MultipartFile(path)
+            sent = time.perf_counter()
+            try:
+                response = self.session.post(url, data=body, timeout=self.timeout, headers={
+                    'Content-Type': body.content_type,
+                    'Content-Length': str(len(body)),
+                })
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                result.error = err
+                continue
+            finally:
+                result.latency = time.perf_counter() - sent
+
+            result.status_code = response.status_code
+            result.response = _parse_response(response)
+            result.error = None
+            if not self._retryable(response.status_code):
+                break
+
+        result.elapsed = time.perf_counter() - start
+        with self._lock:
+            self.results.append(result)
+        return result
+
+    def upload_files(self, uuid, paths):
+        """Upload `paths` concurrently and return their results in the same order."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda path: self.upload_file(uuid, path), paths))
+
+    def close(self):
+        self.session.close()
+
+def print_result(result):
+    filename = os.path.basename(result.path)
+    if result.status_code is None:
+        print(f"... uploading {filename}: failed after {result.attempts} attempts - {result.error}")
+        return
+    print(f"... uploading {filename}: {result.status_code} - {result.response}")
+    print("...     {0} bytes in {1:.2f} s ({2:.0f} kB/s), {3} attempt(s), {4:.2f} s in total".format(
+        result.size, result.latency, result.throughput / 1000, result.attempts, result.elapsed))
+
+def artifact_files(directory="artifacts", allowed_extensions=ALLOWED_EXTENSIONS):
+    paths = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))]
+    return [path for path in paths if os.path.isfile(path) and os.path.splitext(path)[1] in allowed_extensions]
+
+class UploadQueue:
+    def __init__(self, uuid, uploader=None, allowed_extensions=ALLOWED_EXTENSIONS):
+        self.uuid = uuid
+        self.uploader = uploader or Uploader()
+        self.allowed_extensions = allowed_extensions
+        self.published = []
+        self._queue = queue.Queue()
+        self._futures = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.uploader.workers)
+        self._thread = threading.Thread(target=self._drain, name='upload-queue', daemon=True)
+        self._thread.start()
+
+    def publish(self, path):
+        """Queue a finished artifact for upload; other file types and repeated paths are ignored."""
+        if os.path.splitext(path)[1] not in self.allowed_extensions or path in self.published:
+            return
+        self.published.append(path)
+        self._queue.put(path)
+
+    def publish_stage(self, stage, elapsed):
+        """`on_stage_done` hook for run_pipeline, publishing the stage's outputs."""
+        for path in stage.outputs:
+            self.publish(path)
+
+    def _drain(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                break
+            print(f"... upload of {os.path.basename(path)} started")
+            future = self._executor.submit(self.uploader.upload_file, self.uuid, path)
+            future.add_done_callback(self._report)
+            self._futures.append(future)
+
+    def _report(self, future):
+        if future.exception() is None:
+            print_result(future.result())
+
+    def close(self):
+        """Wait for every published artifact to be uploaded and return their results."""
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self.uploader.close()
+
+        results = []
+        for future in self._futures:
+            try:
+                results.append(future.result())
+            except Exception as err:
+                print(f"... upload failed: {err}")
+        return results
+
+def upload_artifacts(uuid, directory="artifacts", api_url=API_URL, workers=WORKERS):
     print('upload_artifacts start')
 
-    api_url = f"{API_URL}{uuid}"
-    directory = "artifacts"
-    allowed_extensions = {".mp4", ".mid"}
-
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-        
-        if os.path.isfile(file_path) and any(filename.endswith(ext) for ext in allowed_extensions):
-            with open(file_path, "rb") as file:
-                files = {"file": file}
-                response = requests.post(api_url, files=files)
-                
-                # Check response content before parsing JSON
-                try:
-                    json_response = response.json()
-                except requests.exceptions.JSONDecodeError:
-                    json_response = {"error": "Invalid or empty response from server", "status_code": response.status_code}
-
-                print(f"... uploading {filename}: {response.status_code} - {json_response}")
+    uploader = Uploader(api_url, workers=workers)
+    start = time.perf_counter()
+    try:
+        results = uploader.upload_files(uuid, artifact_files(directory))
+    finally:
+        uploader.close()
+
+    for result in results:
+        print_result(result)
+    total = sum(result.size for result in results)
+    print(f"... {len(results)} files, {total} bytes in {time.perf_counter() - start:.2f} s")
 
     print('upload_artifacts end')
+    return results